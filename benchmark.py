@@ -6,14 +6,29 @@ from sqlalchemy_memory import MemorySession
 import argparse
 import time
 import random
-from faker import Faker
 
 
 random.seed(42)
 Base = declarative_base()
-fake = Faker()
 CATEGORIES = list("ABCDEFGHIJK")
 
+_names = None
+
+def get_names():
+    """
+    Names are drawn from a pool, generated once on first use: generating them
+    with Faker for each row would take longer than inserting the rows
+    """
+    global _names
+    if _names is None:
+        from faker import Faker
+
+        Faker.seed(42)
+        fake = Faker()
+        _names = [fake.name() for _ in range(5000)]
+
+    return _names
+
 class Item(Base):
     __tablename__ = "items"
 
@@ -25,11 +40,15 @@ class Item(Base):
     cost = Column(Float)
 
 def generate_items(n):
-    for _ in range(n):
+    names = random.choices(get_names(), k=n)
+    actives = random.choices([True, False], k=n)
+    categories = random.choices(CATEGORIES, k=n)
+
+    for name, active, category in zip(names, actives, categories):
         yield Item(
-            name=fake.name(),
-            active=random.choice([True, False]),
-            category=random.choice(CATEGORIES),
+            name=name,
+            active=active,
+            category=category,
             price=round(random.uniform(5, 500), 2),
             cost=round(random.uniform(1, 300), 2),
         )
@@ -95,13 +114,15 @@ def selects(Session, count, fetch_type):
 def updates(Session, random_ids):
     update_start = time.time()
     with Session() as session:
-        for rid in random_ids:
-            stmt = update(Item).where(Item.id == rid).values(
-                name=fake.name(),
-                category=random.choice(CATEGORIES),
-                active=random.choice([True, False])
-            )
-            session.execute(stmt)
+        names = random.choices(get_names(), k=len(random_ids))
+        categories = random.choices(CATEGORIES, k=len(random_ids))
+        actives = random.choices([True, False], k=len(random_ids))
+
+        # ORM bulk UPDATE by primary key: a single statement for all rows
+        session.execute(update(Item), [
+            dict(id=rid, name=name, category=category, active=active)
+            for rid, name, category, active in zip(random_ids, names, categories, actives)
+        ])
         session.commit()
     update_duration = time.time() - update_start
     print(f"Executed {len(random_ids)} updates in {update_duration:.2f} seconds.")
@@ -110,9 +131,8 @@ def updates(Session, random_ids):
 def deletes(Session, random_ids):
     delete_start = time.time()
     with Session() as session:
-        for rid in random_ids:
-            stmt = delete(Item).where(Item.id == rid)
-            session.execute(stmt)
+        stmt = delete(Item).where(Item.id.in_(random_ids))
+        session.execute(stmt)
         session.commit()
     delete_duration = time.time() - delete_start
     print(f"Deleted {len(random_ids)} items in {delete_duration:.2f} seconds.")
@@ -136,6 +156,9 @@ def run_benchmark(db_type="sqlite", count=100_000):
 
     Base.metadata.create_all(engine)
 
+    # Build the names pool outside of the timed sections
+    get_names()
+
     elapsed = inserts(Session, count)
     elapsed += selects(Session, 500, fetch_type="all")
     elapsed += selects(Session, 500, fetch_type="limit")
@@ -0,0 +1,292 @@
+from functools import lru_cache
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql import operators
+
+# Python source for each operator: {0} is the row value, {1} the compared value
+OPERATOR_TEMPLATES = {
+    operators.eq: "{0} == {1}",
+    operators.ne: "{0} != {1}",
+    operators.lt: "{0} < {1}",
+    operators.le: "{0} <= {1}",
+    operators.gt: "{0} > {1}",
+    operators.ge: "{0} >= {1}",
+    operators.is_: "{0} is {1}",
+    operators.isnot: "{0} is not {1}",
+    operators.in_op: "{0} in {1}",
+    operators.not_in_op: "{0} not in {1}",
+    operators.between_op: "{1}[0] <= {0} <= {1}[1]",
+    operators.not_between_op: "not ({1}[0] <= {0} <= {1}[1])",
+}
+
+# Comparisons never matched by NULL values (SQL NULL semantics), as in the
+# range indexes which don't hold them: the row value is tested before comparing
+NULL_REJECTING = frozenset([
+    operators.lt,
+    operators.le,
+    operators.gt,
+    operators.ge,
+    operators.between_op,
+    operators.not_between_op,
+])
+
+
+# Range bounds folded into a single chained comparison when a column has both:
+# lower bound operator => "{value} <op> column", upper bound => "column <op> {value}"
+LOWER_BOUNDS = {
+    operators.gt: "<",
+    operators.ge: "<=",
+}
+UPPER_BOUNDS = {
+    operators.lt: "<",
+    operators.le: "<=",
+}
+
+
+def _condition_shape(compiled):
+    if compiled.indexable and compiled.operator in OPERATOR_TEMPLATES:
+        return compiled.attr_name, compiled.operator
+
+    # Opaque condition: evaluated through its predicate
+    return None
+
+
+def _find_opposite_bound(shape, idx, folded):
+    """
+    Position of a later condition bounding the same column from the other side
+    """
+    attr_name, operator = shape[idx]
+    if operator in LOWER_BOUNDS:
+        opposite = UPPER_BOUNDS
+    elif operator in UPPER_BOUNDS:
+        opposite = LOWER_BOUNDS
+    else:
+        return None
+
+    for other in range(idx + 1, len(shape)):
+        condition = shape[other]
+        if other not in folded and condition is not None and condition[0] == attr_name and condition[1] in opposite:
+            return other
+
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _build_filter(shape):
+    """
+    Generate a generator function yielding the rows matching all conditions of a shape.
+
+    Column values are read straight from the instance ``__dict__``, skipping the
+    ORM attribute instrumentation.
+    """
+    args = [f"v{idx}" for idx in range(len(shape))]
+
+    tests = []
+    folded = set()
+    for idx, condition in enumerate(shape):
+        if idx in folded:
+            continue
+
+        arg = args[idx]
+        if condition is None:
+            tests.append(f"{arg}(item)")
+            continue
+
+        attr_name, operator = condition
+        value = f"row.get({attr_name!r})"
+
+        guard = ""
+        if operator in NULL_REJECTING:
+            # The column value is read once, and compared if not NULL
+            guard = f"(c{idx} := {value}) is not None and "
+            value = f"c{idx}"
+
+        bound = _find_opposite_bound(shape, idx, folded)
+        if bound is not None:
+            # low < value < high: the column is read and compared in one go
+            folded.add(bound)
+            low, high = (idx, bound) if operator in LOWER_BOUNDS else (bound, idx)
+            low_op = LOWER_BOUNDS[shape[low][1]]
+            high_op = UPPER_BOUNDS[shape[high][1]]
+            tests.append(f"{guard}{args[low]} {low_op} {value} {high_op} {args[high]}")
+            continue
+
+        tests.append(guard + OPERATOR_TEMPLATES[operator].format(value, arg))
+
+    source = "\n".join([
+        f"def _filter(stream, {', '.join(args)}):",
+        "    for item in stream:",
+        "        row = item.__dict__",
+        f"        if {' and '.join(tests)}:",
+        "            yield item",
+    ])
+
+    namespace = {}
+    exec(compile(source, "<sqlalchemy_memory.codegen>", "exec"), namespace)
+    return namespace["_filter"]
+
+
+def filter_rows(conditions, stream):
+    """
+    Lazily filter a stream of rows on a conjunction of compiled conditions.
+
+    Generated filters are cached on the shape of the conditions (column names and
+    operators): values are passed as arguments, so queries only differing by their
+    values share the same function.
+    """
+    shape = tuple(_condition_shape(c) for c in conditions)
+    if shape == (None,):
+        # A single opaque condition: let filter() call its predicate from C
+        return filter(conditions[0].predicate, stream)
+
+    args = [
+        c.predicate if s is None else c.operand
+        for c, s in zip(conditions, shape)
+    ]
+    return _build_filter(shape)(stream, *args)
+
+
+@lru_cache(maxsize=1024)
+def _build_predicate(condition):
+    """
+    Generate the factory of a single-condition row predicate, for a column name
+    and operator: the compared value is bound in the predicate's closure.
+    """
+    attr_name, operator = condition
+    value = f"item.__dict__.get({attr_name!r})"
+    if operator in NULL_REJECTING:
+        test = "(c0 := {}) is not None and {}".format(value, OPERATOR_TEMPLATES[operator].format("c0", "v0"))
+    else:
+        test = OPERATOR_TEMPLATES[operator].format(value, "v0")
+
+    source = "\n".join([
+        "def _make_predicate(v0):",
+        "    def _predicate(item):",
+        f"        return {test}",
+        "    return _predicate",
+    ])
+
+    namespace = {}
+    exec(compile(source, "<sqlalchemy_memory.codegen>", "exec"), namespace)
+    return namespace["_make_predicate"]
+
+
+def make_predicate(compiled):
+    """
+    Return a specialized row predicate for a compiled condition, or None if its
+    operator has no template.
+    """
+    condition = _condition_shape(compiled)
+    if condition is None:
+        return None
+    return _build_predicate(condition)(compiled.operand)
+
+
+@lru_cache(maxsize=1024)
+def _build_projection(names):
+    """
+    Generate a generator function yielding a tuple of column values per row,
+    read from the instance ``__dict__``.
+    """
+    values = "".join(f"row.get({name!r}), " for name in names)
+
+    source = "\n".join([
+        "def _project(stream):",
+        "    for item in stream:",
+        "        row = item.__dict__",
+        f"        yield ({values})",
+    ])
+
+    namespace = {}
+    exec(compile(source, "<sqlalchemy_memory.codegen>", "exec"), namespace)
+    return namespace["_project"]
+
+
+def project_rows(names, stream):
+    """
+    Lazily project a stream of rows onto tuples of the named columns.
+    """
+    return _build_projection(tuple(names))(stream)
+
+
+@lru_cache(maxsize=1024)
+def _build_grouping(names):
+    """
+    Generate a function gathering rows in lists keyed by a tuple of column values,
+    read from the instance ``__dict__``.
+    """
+    values = "".join(f"row.get({name!r}), " for name in names)
+
+    source = "\n".join([
+        "def _group(stream):",
+        "    grouped = {}",
+        "    for item in stream:",
+        "        row = item.__dict__",
+        f"        key = ({values})",
+        "        group = grouped.get(key)",
+        "        if group is None:",
+        "            grouped[key] = [item]",
+        "        else:",
+        "            group.append(item)",
+        "    return grouped",
+    ])
+
+    namespace = {}
+    exec(compile(source, "<sqlalchemy_memory.codegen>", "exec"), namespace)
+    return namespace["_group"]
+
+
+def group_rows(names, stream):
+    """
+    Group a stream of rows on the named columns: returns a dict of
+    key tuple => list of rows, in order of first appearance.
+    """
+    return _build_grouping(tuple(names))(stream)
+
+
+@lru_cache(maxsize=1024)
+def make_sort_key(names):
+    """
+    Generate a sort key function returning the value of a column, or a tuple
+    of column values, read from the instance ``__dict__``.
+    """
+    if len(names) == 1:
+        key = f"item.__dict__.get({names[0]!r})"
+    else:
+        key = "(" + "".join(f"row.get({name!r}), " for name in names) + ")"
+
+    source = "\n".join([
+        "def _sort_key(item):",
+        "    row = item.__dict__",
+        f"    return {key}",
+    ])
+
+    namespace = {}
+    exec(compile(source, "<sqlalchemy_memory.codegen>", "exec"), namespace)
+    return namespace["_sort_key"]
+
+
+@lru_cache(maxsize=1024)
+def make_updater(names):
+    """
+    Generate a function setting the named columns of a row to new committed
+    values, without going through the attribute events, and returning the
+    changes as {name: {"old": ..., "new": ...}} for the indexes.
+    """
+    args = [f"v{idx}" for idx in range(len(names))]
+
+    changes = "".join(
+        f"{name!r}: {{'old': row.get({name!r}), 'new': {arg}}}, "
+        for name, arg in zip(names, args)
+    )
+
+    source = "\n".join([
+        f"def _update(item, {', '.join(args)}):",
+        "    row = item.__dict__",
+        f"    changes = {{{changes}}}",
+        *(f"    set_committed_value(item, {name!r}, {arg})" for name, arg in zip(names, args)),
+        "    return changes",
+    ])
+
+    namespace = {"set_committed_value": set_committed_value}
+    exec(compile(source, "<sqlalchemy_memory.codegen>", "exec"), namespace)
+    return namespace["_update"]
@@ -1,6 +1,7 @@
 from sqlalchemy.engine import URL, default
 from sqlalchemy import event
 from sqlalchemy.orm import Mapper
+from sqlalchemy.orm.attributes import NEVER_SET, NO_VALUE
 import types
 import contextvars
 from .connection import MemoryDBAPIConnection
@@ -33,6 +34,8 @@ class MemoryDialect(default.DefaultDialect):
         def auto_attach_tracking(_, class_):
             logger.debug(f"Attaching tracking to class {class_}")
 
+            self._store.index_manager.register_table(class_.__table__)
+
             for column in class_.__table__.columns:
                 event.listen(
                     getattr(class_, column.name),
@@ -41,13 +44,17 @@ class MemoryDialect(default.DefaultDialect):
                     retval=False,
                 )
 
-    def _track_field_change_listener(self, *a, **kw):
+    def _track_field_change_listener(self, target, value, oldvalue, initiator):
+        if oldvalue is NO_VALUE or oldvalue is NEVER_SET:
+            # First assignment (e.g. from the constructor): nothing to track
+            return
+
         try:
             store = get_current_store()
         except LookupError:
             return
 
-        store._track_field_change_listener(*a, **kw)
+        store._track_field_change_listener(target, value, oldvalue, initiator)
 
     def initialize(self, connection):
         super().initialize(connection)
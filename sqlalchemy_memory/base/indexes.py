@@ -1,14 +1,30 @@
 from collections import defaultdict
-from sortedcontainers import SortedDict
-from typing import Any, List, Generator
-from itertools import chain
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterator
+from itertools import chain, filterfalse
+from operator import attrgetter
 from sqlalchemy.sql import operators
 
-from ..helpers.ordered_set import OrderedSet
+# Operator => RangeIndex.query bounds for a compared value
+RANGE_BOUNDS = {
+    operators.gt: lambda value: dict(gt=value),
+    operators.ge: lambda value: dict(gte=value),
+    operators.lt: lambda value: dict(lt=value),
+    operators.le: lambda value: dict(lte=value),
+    operators.between_op: lambda value: dict(gte=value[0], lte=value[1]),
+}
+
+
+# Marks a column missing from IndexManager.columns_mapping (None: not indexed)
+_UNMAPPED = object()
+
+
+def _is_bounds(value):
+    return isinstance(value, (tuple, list)) and len(value) == 2
 
 
 class IndexManager:
-    __slots__ = ('hash_index', 'range_index', 'table_indexes', 'columns_mapping', )
+    __slots__ = ('hash_index', 'range_index', 'table_indexes', 'columns_mapping', 'index_specs', )
 
     def __init__(self):
         self.hash_index = HashIndex()
@@ -16,98 +32,154 @@ class IndexManager:
 
         self.table_indexes = {}
         self.columns_mapping = {}
+        self.index_specs = {}
 
     
     def get_indexes(self, obj):
         """
         Retrieve index from object's table as dict: indexname => list of column name
         """
-        tablename = obj.__tablename__
+        indexes = self.table_indexes.get(obj.__tablename__)
+        if indexes is None:
+            indexes = self.register_table(obj.__table__)
+
+        return indexes
+
+    def register_table(self, table):
+        """
+        Read the indexes of a table and map its columns to them
+        """
+        tablename = table.name
+        indexes = self.table_indexes[tablename] = {}
+        for cls in [cls for cls in self.index_specs if getattr(cls, "__tablename__", None) == tablename]:
+            del self.index_specs[cls]
 
-        if tablename not in self.table_indexes:
-            self.table_indexes[tablename] = {}
+        pk_col_name = table.primary_key.columns[0].name
 
-            pk_col_name = obj.__table__.primary_key.columns[0].name
+        for index in table.indexes:
+            if len(index.expressions) > 1:
+                # Ignoring compound indexes for now ...
+                continue
 
-            for index in obj.__table__.indexes:
-                if len(index.expressions) > 1:
-                    # Ignoring compound indexes for now ...
-                    continue
+            if index.name == pk_col_name:
+                pk_col_name = None
 
-                if index.name == pk_col_name:
-                    pk_col_name = None
+            indexes[index.name] = [
+                col.name
+                for col in index.expressions
+            ]
 
-                self.table_indexes[tablename][index.name] = [
-                    col.name
-                    for col in index.expressions
-                ]
+        if pk_col_name:
+            indexes[pk_col_name] = [pk_col_name]
 
-            if pk_col_name:
-                self.table_indexes[tablename][pk_col_name] = [pk_col_name]
+        for column in table.columns:
+            self.columns_mapping.pop((tablename, column.name), None)
+            self._column_to_index(tablename, column.name)
 
-        return self.table_indexes[tablename]
+        return indexes
 
 
     def _column_to_index(self, tablename, colname):
         """
         Get index name from tablename & column name
         """
-        if tablename not in self.columns_mapping:
-            self.columns_mapping[tablename] = {}
+        key = (tablename, colname)
+        indexname = self.columns_mapping.get(key, _UNMAPPED)
+        if indexname is not _UNMAPPED:
+            return indexname
+
+        indexes = self.table_indexes.get(tablename)
+        if indexes is None:
+            # Table not seen yet: don't cache
+            return None
 
-        if colname not in self.columns_mapping[tablename]:
-            for indexname, indexcols in self.table_indexes.get(tablename, {}).items():
-                if colname in indexcols:
-                    self.columns_mapping[tablename][colname] = indexname
-                    return indexname
+        indexname = None
+        for name, indexcols in indexes.items():
+            if colname in indexcols:
+                indexname = name
+                break
 
-            self.columns_mapping[tablename][colname] = None
+        self.columns_mapping[key] = indexname
+        return indexname
 
+    def _get_index_specs(self, obj):
+        """
+        Retrieve the indexes of the object's table, resolved once per mapped class
+        as tuples of (columns, key getter, hash postings, hash snapshots, range postings)
+        """
+        specs = self.index_specs.get(type(obj))
+        if specs is None:
+            tablename = obj.__tablename__
+            specs = self.index_specs[type(obj)] = tuple(
+                (
+                    columns,
+                    attrgetter(*columns),
+                    self.hash_index.postings(tablename, indexname),
+                    self.hash_index.snapshots(tablename, indexname),
+                    self.range_index.postings(tablename, indexname),
+                )
+                for indexname, columns in self.get_indexes(obj).items()
+            )
 
-        return self.columns_mapping[tablename][colname]
+        return specs
 
+    def on_insert(self, obj):
+        for _, get_key, hash_postings, hash_snapshots, range_postings in self._get_index_specs(obj):
+            value = get_key(obj)
+
+            HashIndex.add_to(hash_postings, hash_snapshots, value, obj)
+            RangeIndex.add_to(range_postings, value, obj)
     
-    def _get_index_key(self, obj, columns):
-        if len(columns) == 1:
-            return getattr(obj, columns[0])
-        return tuple(getattr(obj, c) for c in columns)
+    def on_insert_many(self, objs):
+        """
+        Index new rows of a same table, one index at a time
+        """
+        if not objs:
+            return
 
-    def on_insert(self, obj):
-        tablename = obj.__tablename__
-        indexes = self.get_indexes(obj)
+        for _, get_key, hash_postings, hash_snapshots, range_postings in self._get_index_specs(objs[0]):
+            for obj in objs:
+                value = get_key(obj)
 
-        for indexname, columns in indexes.items():
-            value = self._get_index_key(obj, columns)
+                HashIndex.add_to(hash_postings, hash_snapshots, value, obj)
+                RangeIndex.add_to(range_postings, value, obj)
 
-            self.hash_index.add(tablename, indexname, value, obj)
-            self.range_index.add(tablename, indexname, value, obj)
-    
     def on_delete(self, obj):
-        tablename = obj.__tablename__
-        indexes = self.get_indexes(obj)
+        for _, get_key, hash_postings, hash_snapshots, range_postings in self._get_index_specs(obj):
+            value = get_key(obj)
 
-        for indexname, columns in indexes.items():
-            value = self._get_index_key(obj, columns)
+            HashIndex.remove_from(hash_postings, hash_snapshots, value, obj)
+            RangeIndex.remove_from(range_postings, value, obj)
 
-            self.hash_index.remove(tablename, indexname, value, obj)
-            self.range_index.remove(tablename, indexname, value, obj)
+    def on_delete_many(self, objs):
+        """
+        Unindex deleted rows of a same table, one index at a time: rows are
+        grouped by value, so that each value's postings are updated once
+        """
+        if not objs:
+            return
 
-    def on_update(self, obj, updates):
-        tablename = obj.__tablename__
-        indexes = self.get_indexes(obj)
+        for _, get_key, hash_postings, hash_snapshots, range_postings in self._get_index_specs(objs[0]):
+            grouped = defaultdict(list)
+            for obj in objs:
+                grouped[get_key(obj)].append(obj)
+
+            HashIndex.remove_many_from(hash_postings, hash_snapshots, grouped)
+            RangeIndex.remove_many_from(range_postings, grouped)
 
-        for indexname, columns in indexes.items():
+    def on_update(self, obj, updates):
+        for columns, _, hash_postings, hash_snapshots, range_postings in self._get_index_specs(obj):
             if columns[0] not in updates:
                 continue
 
             old_value = updates[columns[0]]["old"]
             new_value = updates[columns[0]]["new"]
 
-            self.hash_index.remove(tablename, indexname, old_value, obj)
-            self.range_index.remove(tablename, indexname, old_value, obj)
+            HashIndex.remove_from(hash_postings, hash_snapshots, old_value, obj)
+            RangeIndex.remove_from(range_postings, old_value, obj)
 
-            self.hash_index.add(tablename, indexname, new_value, obj)
-            self.range_index.add(tablename, indexname, new_value, obj)
+            HashIndex.add_to(hash_postings, hash_snapshots, new_value, obj)
+            RangeIndex.add_to(range_postings, new_value, obj)
 
     def query(self, collection, tablename, colname, operator, value, collection_is_full_table=False):
         indexname = self._column_to_index(tablename, colname)
@@ -115,70 +187,66 @@ class IndexManager:
             return None
 
         if operator == operators.eq:
-            result = self.hash_index.query(tablename, indexname, value)
             if collection_is_full_table:
-                return result
-            return (item for item in collection if item in result)
+                return iter(self.hash_index.snapshot(tablename, indexname, value))
+            result = self.hash_index.query(tablename, indexname, value)
+            if not result:
+                # Missing key: no need to go through the collection
+                return iter(())
+            return filter(result.__contains__, collection)
 
         elif operator == operators.ne:
             excluded = self.hash_index.query(tablename, indexname, value)
-            return (item for item in collection if item not in excluded)
+            return filterfalse(excluded.__contains__, collection)
 
         elif operator == operators.in_op:
-            result = chain.from_iterable(
-                self.hash_index.query(tablename, indexname, v) for v in value
-            )
+            result = self.hash_index.query_many(tablename, indexname, value)
             if collection_is_full_table:
-                return result
-            result = set(result)
-            return (item for item in collection if item in result)
+                return iter(result)
+            if not result:
+                return iter(())
+            return filter(result.__contains__, collection)
 
         elif operator == operators.notin_op:
-            excluded = set(chain.from_iterable(
-                self.hash_index.query(tablename, indexname, v) for v in value
-            ))
-            return (item for item in collection if item not in excluded)
+            excluded = self.hash_index.query_many(tablename, indexname, value)
+            return filterfalse(excluded.__contains__, collection)
 
-        elif operator == operators.gt:
-            result = self.range_index.query(tablename, indexname, gt=value)
-            if collection_is_full_table:
-                return result
-            result = set(result)
-            return (item for item in collection if item in result)
+        elif operator in RANGE_BOUNDS:
+            if operator is operators.between_op and not _is_bounds(value):
+                return None
 
-        elif operator == operators.ge:
-            result = self.range_index.query(tablename, indexname, gte=value)
             if collection_is_full_table:
-                return result
-            result = set(result)
-            return (item for item in collection if item in result)
+                return self.range_index.scan(tablename, indexname, **RANGE_BOUNDS[operator](value))
+            result = set(self.range_index.query(tablename, indexname, **RANGE_BOUNDS[operator](value)))
+            return filter(result.__contains__, collection)
+
+        elif operator == operators.not_between_op and _is_bounds(value) and collection_is_full_table:
+            # Rows on both sides of the range, straight from the index. A narrowed
+            # collection is better filtered by the condition itself than against
+            # rows of almost the whole table
+            return chain(
+                self.range_index.scan(tablename, indexname, lt=value[0]),
+                self.range_index.scan(tablename, indexname, gt=value[1]),
+            )
 
-        elif operator == operators.lt:
-            result = self.range_index.query(tablename, indexname, lt=value)
-            if collection_is_full_table:
-                return result
-            result = set(result)
-            return (item for item in collection if item in result)
+    def range_fraction(self, tablename, colname, operator, value):
+        """
+        Estimate the fraction of rows matched by a range condition, from the
+        number of distinct index keys falling inside the range.
+        Returns None if the column isn't indexed or the operator isn't a range one.
+        """
+        if operator not in RANGE_BOUNDS:
+            return None
 
-        elif operator == operators.le:
-            result = self.range_index.query(tablename, indexname, lte=value)
-            if collection_is_full_table:
-                return result
-            result = set(result)
-            return (item for item in collection if item in result)
+        if operator is operators.between_op and not _is_bounds(value):
+            return None
 
-        elif operator == operators.between_op and isinstance(value, (tuple, list)) and len(value) == 2:
-            result = self.range_index.query(tablename, indexname, gte=value[0], lte=value[1])
-            if collection_is_full_table:
-                return result
-            result = set(result)
-            return (item for item in collection if item in result)
+        indexname = self._column_to_index(tablename, colname)
+        if not indexname:
+            return None
 
-        elif operator == operators.not_between_op and isinstance(value, (tuple, list)) and len(value) == 2:
-            in_range = set(self.range_index.query(tablename, indexname, gte=value[0], lte=value[1]))
-            return (item for item in collection if item not in in_range)
+        return self.range_index.key_fraction(tablename, indexname, **RANGE_BOUNDS[operator](value))
 
-    
     def get_selectivity(self, tablename, colname, operator, value, total_count):
         """
         Estimate the selectivity of a single WHERE condition.
@@ -194,8 +262,8 @@ class IndexManager:
             # Column isn't indexed
             return total_count
 
-        if indexname in self.hash_index.index[tablename]:
-            index = self.hash_index.index[tablename][indexname]
+        index = self.hash_index.index.get((tablename, indexname))
+        if index is not None:
             num_keys = len(index)
 
             if operator == operators.eq:
@@ -206,12 +274,22 @@ class IndexManager:
                 return total_count - matched
 
             elif operator == operators.in_op:
-                return sum(len(index.get(v, [])) for v in value)
+                # Repeated values match the same rows
+                return sum(len(index.get(v, [])) for v in set(value))
 
             elif operator == operators.notin_op:
-                matched = sum(len(index.get(v, [])) for v in value)
+                matched = sum(len(index.get(v, [])) for v in set(value))
                 return total_count - matched
 
+            if operator == operators.not_between_op and _is_bounds(value):
+                # Rows outside of the range
+                fraction = self.range_fraction(tablename, colname, operators.between_op, value)
+                return total_count * (1 - fraction)
+
+            fraction = self.range_fraction(tablename, colname, operator, value)
+            if fraction is not None:
+                return total_count * fraction
+
             return total_count / num_keys
 
         return total_count
@@ -221,76 +299,274 @@ class HashIndex:
     A hash-based index structure for fast exact-match lookups on table columns.
 
     Structure:
-        index[tablename][indexname][value] = [obj1, obj2, ...]
+        index[tablename, indexname][value] = {obj1: None, obj2: None, ...}
 
+    Postings are plain dicts keyed by the row object itself: rows hash by
+    identity, so membership tests and removals are O(1) and done in C.
     Maintains insertion order of objects.
+
+    Rows matching a value are also handed out as a tuple snapshot, built on
+    first lookup and dropped when the rows for that value change, so that
+    results stay valid while the index is modified.
     """
 
-    __slots__ = ('index',)
+    __slots__ = ('index', '_snapshots', )
 
     def __init__(self):
-        self.index = defaultdict(lambda: defaultdict(lambda: defaultdict(OrderedSet)))
+        self.index = defaultdict(lambda: defaultdict(dict))
+        self._snapshots = defaultdict(dict)
+
+
+    def postings(self, tablename: str, indexname: str):
+        return self.index[tablename, indexname]
+
+    def snapshots(self, tablename: str, indexname: str):
+        return self._snapshots[tablename, indexname]
 
+    @staticmethod
+    def add_to(postings, snapshots, value: Any, obj: Any):
+        postings[value][obj] = None
+        snapshots.pop(value, None)
+
+    @staticmethod
+    def remove_from(postings, snapshots, value: Any, obj: Any):
+        s = postings.get(value)
+        if s is None:
+            return
+
+        s.pop(obj, None)
+        snapshots.pop(value, None)
+        if not s:
+            del postings[value]
+
+    @staticmethod
+    def remove_many_from(postings, snapshots, grouped):
+        """
+        Remove rows given as a dict of value => list of rows
+        """
+        for value, objs in grouped.items():
+            s = postings.get(value)
+            if s is None:
+                continue
+
+            for obj in objs:
+                s.pop(obj, None)
+            snapshots.pop(value, None)
+            if not s:
+                del postings[value]
 
     def add(self, tablename: str, indexname: str, value: Any, obj: Any):
-        self.index[tablename][indexname][value].add(obj)
+        self.add_to(self.index[tablename, indexname], self._snapshots[tablename, indexname], value, obj)
 
 
     def remove(self, tablename: str, indexname: str, value: Any, obj: Any):
-        s = self.index[tablename][indexname][value]
-        s.discard(obj)
+        self.remove_from(self.index[tablename, indexname], self._snapshots[tablename, indexname], value, obj)
+
+    def query(self, tablename: str, indexname: str, value: Any) -> Dict[Any, None]:
+        return self.index[tablename, indexname].get(value, {})
+
+    def snapshot(self, tablename: str, indexname: str, value: Any) -> tuple:
+        """
+        Rows matching the value, as a tuple cached until they change
+        """
+        snapshots = self._snapshots[tablename, indexname]
+        snapshot = snapshots.get(value)
+        if snapshot is None:
+            bucket = self.index[tablename, indexname].get(value)
+            if bucket is None:
+                return ()
+            snapshot = snapshots[value] = tuple(bucket)
+        return snapshot
+
+    def query_many(self, tablename: str, indexname: str, values) -> Dict[Any, None]:
+        """
+        Rows matching any of the values, without duplicates
+        """
+        index = self.index[tablename, indexname]
+        result = {}
+        for value in values:
+            if value in index:
+                result.update(index[value])
+        return result
+
+
+class SortedPostings:
+    """
+    Postings of one range index: a dict of value => {obj1: None, ...} along
+    with the distinct values kept in a flat sorted list for bisecting.
+
+    New values are buffered and merged into the sorted list on the next
+    lookup, so that inserting rows doesn't pay for a sorted insertion each.
+    NULL values are not kept: they never match a range comparison.
+    """
+
+    __slots__ = ('postings', 'keys', 'pending', )
+
+    # Below this number of buffered (or removed) values, they are insorted
+    # (or deleted) one by one instead of re-sorting (or filtering) the whole list
+    INSORT_THRESHOLD = 16
+
+    def __init__(self):
+        self.postings = {}
+        self.keys = []
+        self.pending = []
+
+    def __len__(self):
+        return len(self.postings)
+
+    def add(self, value: Any, obj: Any):
+        if value is None:
+            return
+
+        s = self.postings.get(value)
+        if s is None:
+            self.postings[value] = {obj: None}
+            self.pending.append(value)
+        else:
+            s[obj] = None
+
+    def remove(self, value: Any, obj: Any):
+        s = self.postings.get(value)
+        if s is None:
+            return
+
+        s.pop(obj, None)
         if not s:
-            del self.index[tablename][indexname][value]
+            del self.postings[value]
+
+            keys = self.sorted_keys()
+            del keys[bisect_left(keys, value)]
+
+    def remove_many(self, grouped):
+        """
+        Remove rows given as a dict of value => list of rows. When many values
+        are left without rows, the sorted list is filtered once instead of
+        deleting from it value by value.
+        """
+        postings = self.postings
+        emptied = []
+        for value, objs in grouped.items():
+            s = postings.get(value)
+            if s is None:
+                continue
+
+            for obj in objs:
+                s.pop(obj, None)
+            if not s:
+                del postings[value]
+                emptied.append(value)
+
+        if not emptied:
+            return
 
-    def query(self, tablename: str, indexname: str, value: Any) -> List[Any]:
-        return self.index[tablename][indexname].get(value, [])
+        keys = self.sorted_keys()
+        if len(emptied) < self.INSORT_THRESHOLD:
+            for value in emptied:
+                del keys[bisect_left(keys, value)]
+        else:
+            keys[:] = filter(postings.__contains__, keys)
+
+    def sorted_keys(self):
+        pending = self.pending
+        if pending:
+            keys = self.keys
+            if len(pending) < self.INSORT_THRESHOLD:
+                for value in pending:
+                    insort(keys, value)
+            else:
+                keys.extend(pending)
+                keys.sort()
+            pending.clear()
+
+        return self.keys
+
+    def bounds(self, gt=None, gte=None, lt=None, lte=None):
+        """
+        Positions in the sorted keys of the first and past-the-last keys in range
+        """
+        keys = self.sorted_keys()
+
+        start = 0
+        if gte is not None:
+            start = bisect_left(keys, gte)
+        elif gt is not None:
+            start = bisect_right(keys, gt)
+
+        stop = len(keys)
+        if lte is not None:
+            stop = bisect_right(keys, lte)
+        elif lt is not None:
+            stop = bisect_left(keys, lt)
+
+        return start, max(start, stop)
+
+    def range(self, **bounds):
+        start, stop = self.bounds(**bounds)
+        return chain.from_iterable(map(self.postings.__getitem__, self.keys[start:stop]))
+
+    def scan(self, **bounds):
+        """
+        Like range(), but copying the matching rows upfront, so that the postings
+        may change while the result is consumed: rows committed meanwhile don't
+        show up in the result
+        """
+        start, stop = self.bounds(**bounds)
+        return iter(list(chain.from_iterable(map(self.postings.__getitem__, self.keys[start:stop]))))
 
 
 class RangeIndex:
     """
     A range-based index for fast lookups using comparison operators.
 
-    Internally uses SortedDict to allow efficient bisecting and slicing.
     Structure:
-        index[tablename][indexname] = SortedDict { value: [obj1, obj2, ...] }
+        index[tablename, indexname] = SortedPostings
+
+    Like HashIndex, postings are dicts keyed by the row object for O(1) removal.
     """
 
     __slots__ = ('index',)
 
     def __init__(self):
-        self.index = defaultdict(lambda: defaultdict(SortedDict))
+        self.index = defaultdict(SortedPostings)
+
+    def postings(self, tablename: str, indexname: str):
+        return self.index[tablename, indexname]
+
+    @staticmethod
+    def add_to(postings, value: Any, obj: Any):
+        postings.add(value, obj)
+
+    @staticmethod
+    def remove_from(postings, value: Any, obj: Any):
+        postings.remove(value, obj)
+
+    @staticmethod
+    def remove_many_from(postings, grouped):
+        postings.remove_many(grouped)
 
     def add(self, tablename: str, indexname: str, value: Any, obj: Any):
-        index = self.index[tablename][indexname]
-        if value in index:
-            index[value].append(obj)
-        else:
-            index[value] = [obj]
+        self.index[tablename, indexname].add(value, obj)
 
     
     def remove(self, tablename: str, indexname: str, value: Any, obj: Any):
-        col = self.index[tablename][indexname]
-        if value in col:
-            try:
-                col[value].remove(obj)
-                if not col[value]:
-                    del col[value]
-            except ValueError:
-                pass
-
-    def query(self, tablename: str, indexname: str, gt=None, gte=None, lt=None, lte=None) -> Generator:
-        sd = self.index[tablename][indexname]
-
-        # Define range bounds
-        min_key = gte if gte is not None else gt
-        max_key = lte if lte is not None else lt
-        inclusive_min = gte is not None
-        inclusive_max = lte is not None
-
-        keys = sd.irange(
-            minimum=min_key,
-            maximum=max_key,
-            inclusive=(inclusive_min, inclusive_max)
-        )
-
-        return chain.from_iterable(sd[key] for key in keys)
+        self.index[tablename, indexname].remove(value, obj)
+
+    def key_fraction(self, tablename: str, indexname: str, gt=None, gte=None, lt=None, lte=None) -> float:
+        """
+        Fraction of the distinct keys within the range, computed by bisecting
+        the sorted keys (no iteration over the rows)
+        """
+        postings = self.index[tablename, indexname]
+        if not postings:
+            return 0.0
+
+        start, stop = postings.bounds(gt=gt, gte=gte, lt=lt, lte=lte)
+        return (stop - start) / len(postings)
+
+    def query(self, tablename: str, indexname: str, gt=None, gte=None, lt=None, lte=None) -> Iterator:
+        # Lazily chain the postings: nothing is materialized here, callers
+        # consume it either directly or into a set
+        return self.index[tablename, indexname].range(gt=gt, gte=gte, lt=lt, lte=lte)
+
+    def scan(self, tablename: str, indexname: str, gt=None, gte=None, lt=None, lte=None) -> Iterator:
+        return self.index[tablename, indexname].scan(gt=gt, gte=gte, lt=lt, lte=lte)
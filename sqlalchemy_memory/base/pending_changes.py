@@ -2,12 +2,14 @@ from collections import defaultdict
 
 class PendingChanges:
     def __init__(self):
-        self._to_add = defaultdict(list)
+        # Objects to insert, per table: id(obj) => obj
+        self._to_add = defaultdict(dict)
         self._to_delete = defaultdict(list)
         self._to_update = defaultdict(list)
 
         # Modifications done by the user, e.g.: instance.counter += 1
-        self._modifications = defaultdict(dict)
+        # (id(instance), colname) => [instance, old value, new value]
+        self._modifications = {}
 
     def clear(self):
         self.rollback()
@@ -19,8 +21,18 @@ class PendingChanges:
         self._modifications.clear()
 
     def add(self, obj, **kwargs):
-        tablename = obj.__tablename__
-        self._to_add[tablename].append(obj)
+        # Objects already pending are kept once
+        self._to_add[obj.__tablename__][id(obj)] = obj
+
+    def add_all(self, objs):
+        to_add = self._to_add
+        cls = None
+        for obj in objs:
+            if type(obj) is not cls:
+                # Table of a run of objects of the same class, read once
+                cls = type(obj)
+                pending = to_add[cls.__tablename__]
+            pending[id(obj)] = obj
 
     def delete(self, obj):
         tablename = obj.__tablename__
@@ -43,15 +55,25 @@ class PendingChanges:
             item = getattr(self, key)
             if not item:
                 continue
-            setattr(target, key, item.copy())
-            item.clear()
 
-    def mark_field_as_dirty(self, instance, colname, oldvalue, value):
-        key = id(instance)
-        if key not in self._modifications:
-            self._modifications[key]["__instance"] = instance
+            pending = getattr(target, key)
+            if pending:
+                # Changes from an earlier flush are still waiting for the commit
+                for tablename, changes in item.items():
+                    if isinstance(changes, dict):
+                        pending[tablename].update(changes)
+                    else:
+                        pending[tablename].extend(changes)
+                item.clear()
+            else:
+                # Hand over the containers instead of copying them
+                setattr(target, key, item)
+                setattr(self, key, defaultdict(item.default_factory))
 
-        if colname in self._modifications[key]:
-            self._modifications[key][colname][1] = value
+    def mark_field_as_dirty(self, instance, colname, oldvalue, value):
+        key = (id(instance), colname)
+        change = self._modifications.get(key)
+        if change is None:
+            self._modifications[key] = [instance, oldvalue, value]
         else:
-            self._modifications[key][colname] = [oldvalue, value]
+            change[2] = value
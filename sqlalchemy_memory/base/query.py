@@ -1,7 +1,7 @@
 from sqlalchemy.sql.elements import (
     UnaryExpression, BinaryExpression, BindParameter, ExpressionClauseList, BooleanClauseList,
     Grouping, True_, False_, Null,
-    Label, Case,
+    Label, Case, ColumnClause,
 )
 from sqlalchemy.sql.functions import FunctionElement
 from sqlalchemy.sql import operators
@@ -12,35 +12,272 @@ from sqlalchemy.sql.selectable import Select, Join
 from sqlalchemy.sql.dml import Delete, Update
 from sqlalchemy.orm.query import Query
 from sqlalchemy.orm.decl_api import DeclarativeMeta
-from functools import cached_property
-from itertools import tee, islice
+from functools import cached_property, cmp_to_key
+from itertools import islice
+from operator import attrgetter
+from weakref import WeakKeyDictionary
 import fnmatch
+import heapq
+import re
 
 from ..logger import logger
 from ..helpers.utils import _dedup_chain
 from .resolvers import DateResolver, JsonExtractResolver
+from .codegen import NULL_REJECTING, filter_rows, group_rows, make_predicate, make_sort_key, project_rows
+
+def _like_pattern(value):
+    """
+    Compile a SQL LIKE pattern into a regular expression, once per condition.
+    """
+    return re.compile(fnmatch.translate(value.replace('%', '*').replace('_', '?')))
+
+
+def _like_matcher(value):
+    """
+    Return a function testing a string against a SQL LIKE pattern.
+
+    Patterns only made of a literal with leading and/or trailing ``%`` are tested
+    with plain string methods, others with the compiled regular expression.
+    """
+    if '_' not in value:
+        literal = value.strip('%')
+        if '%' not in literal:
+            leading = value.startswith('%')
+            trailing = value.endswith('%')
+            if leading and trailing:
+                return lambda x: literal in x
+            elif trailing:
+                return lambda x: x.startswith(literal)
+            elif leading:
+                return lambda x: x.endswith(literal)
+            return lambda x: x == literal
+
+    match = _like_pattern(value).match
+    return lambda x: match(x) is not None
+
+
+def _like_adapter(value):
+    test = _like_matcher(value)
+    return lambda x, _: test(x or '')
+
+
+def _not_like_adapter(value):
+    test = _like_matcher(value)
+    return lambda x, _: not test(x or '')
+
+
+def _counts_all_rows(fn):
+    """
+    True if a count() function counts every row: count(), count(*), or the
+    count of a non-NULL literal
+    """
+    clauses = list(fn.clauses)
+    if not clauses:
+        return True
+
+    if len(clauses) != 1:
+        return False
+
+    arg = clauses[0]
+    if isinstance(arg, BindParameter):
+        return arg.value is not None
+
+    return isinstance(arg, ColumnClause) and arg.is_literal and arg.name.upper() != "NULL"
+
 
 OPERATOR_ADAPTERS = {
     operators.is_: lambda value: lambda x, _: x is value,
     operators.isnot: lambda value: lambda x, _: x is not value,
-    operators.like_op: lambda value: lambda x, _: fnmatch.fnmatchcase(x or '', value.replace('%', '*').replace('_', '?')),
-    operators.not_like_op: lambda value: lambda x, _: not fnmatch.fnmatchcase(x or '', value.replace('%', '*').replace('_', '?')),
+    operators.like_op: _like_adapter,
+    operators.not_like_op: _not_like_adapter,
     operators.between_op: lambda bounds: lambda x, _: bounds[0] <= x <= bounds[1],
     operators.not_between_op: lambda bounds: lambda x, _: not (bounds[0] <= x <= bounds[1]),
     operators.in_op: lambda values: lambda x, _: x in values,
     operators.not_in_op: lambda values: lambda x, _: x not in values,
 }
 
+# Above this estimated fraction of matched rows, a range condition applied to an
+# already narrowed stream is evaluated by scanning the stream rather than
+# materializing the index range
+RANGE_SCAN_THRESHOLD = 0.2
+
+# Up to this number of rows (offset + limit) to return, ORDER BY keeps the
+# first rows in a heap instead of sorting the whole stream
+TOP_K_MAX = 1000
+
+# Relative cost of evaluating a condition on a row, used to order conditions
+# of equal selectivity
+OPERATOR_COSTS = {
+    operators.eq: 1,
+    operators.ne: 1,
+    operators.is_: 1,
+    operators.isnot: 1,
+    operators.lt: 2,
+    operators.le: 2,
+    operators.gt: 2,
+    operators.ge: 2,
+    operators.between_op: 3,
+    operators.not_between_op: 3,
+    operators.in_op: 3,
+    operators.not_in_op: 3,
+    operators.like_op: 5,
+    operators.not_like_op: 5,
+}
+# Conditions on a function result (DATE(), json_extract) and other expressions
+FUNCTION_COST = 10
+
 FUNCTION_RESOLVERS = {
     "date": DateResolver,
     "json_extract": JsonExtractResolver,
 }
 
+# Compiled WHERE conditions, per statement: statement => {id(cond): CompiledCondition}
+_compiled_conditions = WeakKeyDictionary()
+
+# Query plans, per statement: statement => {property name: value}
+_query_plans = WeakKeyDictionary()
+
+# MemoryQuery cached properties only depending on the statement, reused
+# by later executions of the same statement
+PLAN_PROPERTIES = (
+    "tablename", "is_select", "is_entity_select", "is_count_select",
+    "_limit", "_offset", "_order_by", "_where_criteria", "_sort_keys",
+)
+
+
+def _unwrap_grouping(cond):
+    while isinstance(cond, Grouping):
+        cond = cond.element
+    return cond
+
+
+def _normalize_condition(cond):
+    """
+    Unwrap the groupings of a WHERE condition, merge nested and_ / or_ into their
+    parent of the same operator, and fold TRUE / FALSE constants.
+    """
+    cond = _unwrap_grouping(cond)
+
+    if not isinstance(cond, BooleanClauseList):
+        return cond
+
+    op = cond.operator
+    if op is operators.and_:
+        neutral, absorbing = True_, False_
+    elif op is operators.or_:
+        neutral, absorbing = False_, True_
+    else:
+        return cond
+
+    clauses = []
+    for clause in cond.clauses:
+        clause = _normalize_condition(clause)
+
+        if isinstance(clause, neutral):
+            continue
+        if isinstance(clause, absorbing):
+            return clause
+
+        if isinstance(clause, BooleanClauseList) and clause.operator is op:
+            clauses.extend(clause.clauses)
+        else:
+            clauses.append(clause)
+
+    if not clauses:
+        return neutral()
+    if len(clauses) == 1:
+        return clauses[0]
+
+    # and_() / or_() would group the clauses again
+    return BooleanClauseList._construct_raw(op, clauses)
+
+
+def _compare_rows(sort_keys):
+    """
+    Comparison function of two rows for a list of (column name, descending)
+    """
+    getters = [(make_sort_key((name,)), reverse) for name, reverse in sort_keys]
+
+    def compare(a, b):
+        for getter, reverse in getters:
+            x, y = getter(a), getter(b)
+            if x != y:
+                before = x > y if reverse else x < y
+                return -1 if before else 1
+        return 0
+
+    return compare
+
+
+class CompiledCondition:
+    """
+    A ``LEFT <operator> RIGHT`` condition resolved once into a row predicate.
+    """
+
+    __slots__ = (
+        'table_name', 'attr_name', 'operator', 'value', 'operand', 'indexable', 'predicate',
+        'index_operator', 'index_value',
+    )
+
+    def __init__(self, table_name, attr_name, operator, value, accessor=None, index_condition=None):
+        self.table_name = table_name
+        self.attr_name = attr_name
+        self.operator = operator
+        self.value = value
+
+        # Value compared to the rows: IN lists are tested as a set
+        self.operand = value
+        if operator in (operators.in_op, operators.not_in_op):
+            try:
+                self.operand = frozenset(value)
+            except TypeError:
+                # Unhashable values
+                pass
+
+        # Indexes hold raw column values, not function results
+        self.indexable = accessor is None
+
+        # Condition looked up in the column index: the condition itself, or for a
+        # function its equivalent on the raw column values if there is one
+        self.index_operator, self.index_value = None, None
+        if self.indexable:
+            self.index_operator, self.index_value = operator, value
+        elif index_condition is not None:
+            self.index_operator, self.index_value = index_condition
+
+        # Plain column comparisons are generated, reading the row's __dict__
+        self.predicate = make_predicate(self) or self._build_predicate(accessor)
+
+    def _build_predicate(self, accessor):
+        attr_name = self.attr_name
+        if accessor is None:
+            getter = attrgetter(attr_name)
+        else:
+            getter = lambda item: accessor(item, attr_name)
+
+        operand = self.operand
+        null_rejecting = self.operator in NULL_REJECTING
+        op = self.operator
+        if op in OPERATOR_ADAPTERS:
+            op = OPERATOR_ADAPTERS[op](operand)
+
+        if null_rejecting:
+            def predicate(item):
+                value = getter(item)
+                return value is not None and op(value, operand)
+            return predicate
+
+        return lambda item: op(getter(item), operand)
+
 class MemoryQuery(Query):
     def __init__(self, statement, session):
         self.session = session
         self._statement = statement
 
+        plan = _query_plans.get(statement)
+        if plan is not None:
+            self.__dict__.update(plan)
+
     @property
     def store(self):
         return self.session.store
@@ -80,6 +317,38 @@ class MemoryQuery(Query):
     def is_select(self):
         return isinstance(self._statement, Select)
 
+    @cached_property
+    def is_entity_select(self):
+        """
+        True if this is a simple SELECT [table], yielding the rows themselves
+        """
+        return self.is_select and not self._statement._group_by_clauses and all(
+            isinstance(c, (AnnotatedTable, DeclarativeMeta, Join))
+            for c in self._statement._raw_columns
+        )
+
+    @cached_property
+    def is_count_select(self):
+        """
+        True if this is a SELECT count(...) without GROUP BY
+        """
+        if not self.is_select or self._statement._group_by_clauses:
+            return False
+
+        cols = self._statement._raw_columns
+        if len(cols) != 1:
+            return False
+
+        col = cols[0]
+        if isinstance(col, Label):
+            col = col.element
+        return isinstance(col, FunctionElement) and col.name.lower() == "count" and _counts_all_rows(col)
+
+    @cached_property
+    def _table_count(self):
+        # Number of rows, read once per query for the selectivity estimates
+        return self.store.count(self.tablename)
+
     @cached_property
     def _limit(self):
         if self.is_select and self._statement._limit_clause is not None:
@@ -98,13 +367,35 @@ class MemoryQuery(Query):
 
     @cached_property
     def _where_criteria(self):
-        return self._statement._where_criteria
+        """
+        WHERE criteria normalized once per query into a flat list of AND-ed conditions
+        """
+        cond = _normalize_condition(
+            BooleanClauseList._construct_raw(operators.and_, self._statement._where_criteria)
+        )
+
+        if isinstance(cond, True_):
+            return []
+        if isinstance(cond, BooleanClauseList) and cond.operator is operators.and_:
+            return list(cond.clauses)
+        return [cond]
 
     def iter_items(self):
         gen = self._execute_query()
         gen = self._project(gen)
+        self._save_plan()
         return gen
 
+    def _save_plan(self):
+        """
+        Keep the properties derived from the statement for its next executions
+        """
+        _query_plans[self._statement] = {
+            name: self.__dict__[name]
+            for name in PLAN_PROPERTIES
+            if name in self.__dict__
+        }
+
     def first(self):
         gen = self.iter_items()
         try:
@@ -117,38 +408,66 @@ class MemoryQuery(Query):
         return list(gen)
 
     def filter(self, condition):
-        self._statement._where_criteria.append(condition)
+        self._statement = self._statement.where(condition)
+        self.__dict__.pop("_where_criteria", None)
         return self
 
-    def _apply_boolean_condition(self, cond: BooleanClauseList, stream):
+    def _apply_boolean_condition(self, cond: BooleanClauseList, stream, is_first=False):
         op = cond.operator  # and_ or or_
 
         if op is operators.and_:
             # Apply filters sequentially to the current stream
-            for subcond in cond.clauses:
-                stream = self._apply_condition(subcond, stream)
-            return stream
+            return self._apply_conjunction(cond.clauses, stream, is_first=is_first)
 
-        op = cond.operator
-
-        if op is operators.and_:
-            for subcond in cond.clauses:
-                stream = self._apply_condition(subcond, stream)
+        elif op is operators.or_:
+            if is_first:
+                table = self.store.data.get(self.tablename, [])
 
-            return stream
+                estimate = sum(self._get_condition_selectivity(subcond) for subcond in cond.clauses)
+                if estimate <= RANGE_SCAN_THRESHOLD * len(table):
+                    # Few rows matched: each branch starts from the full table and
+                    # can be served by an index
+                    substreams = [
+                        self._apply_condition(subcond, table, is_first=True)
+                        for subcond in cond.clauses
+                    ]
+                    return _dedup_chain(*substreams)
 
-        elif op is operators.or_:
-            # Materialize the stream once and tee for each OR branch
+                stream = iter(table)
 
-            streams = tee(stream, len(cond.clauses))
-            substreams = [
-                self._apply_condition(subcond, s)
-                for subcond, s in zip(cond.clauses, streams)
-            ]
-            return _dedup_chain(*substreams)
+            # Test each row against the branches in turn, stopping at the first
+            # one it matches: rows come out in table order, without duplicates
+            return filter(self._condition_predicate(cond), stream)
 
         raise NotImplementedError(f"Unsupported BooleanClauseList op: {op}")
 
+    def _condition_predicate(self, cond):
+        """
+        Return a row predicate for a condition, short-circuiting and_ / or_.
+        """
+        if isinstance(cond, BinaryExpression):
+            return self._compile_condition(cond).predicate
+
+        if isinstance(cond, BooleanClauseList):
+            if cond.operator is operators.and_:
+                # Most selective branch first
+                clauses = sorted(cond.clauses, key=self._get_condition_rank)
+                predicates = [self._condition_predicate(clause) for clause in clauses]
+                return lambda item: all(predicate(item) for predicate in predicates)
+
+            elif cond.operator is operators.or_:
+                # Least selective branch first, most rows stop at it
+                clauses = sorted(
+                    cond.clauses,
+                    key=lambda clause: (-self._get_condition_selectivity(clause), self._get_condition_cost(clause))
+                )
+                predicates = [self._condition_predicate(clause) for clause in clauses]
+                return lambda item: any(predicate(item) for predicate in predicates)
+
+            raise NotImplementedError(f"Unsupported BooleanClauseList op: {cond.operator}")
+
+        raise NotImplementedError(f"Unsupported condition type: {type(cond)}")
+
     def _resolve_rhs(self, rhs):
         if isinstance(rhs, BindParameter):
             return rhs.value
@@ -166,12 +485,26 @@ class MemoryQuery(Query):
         else:
             raise NotImplementedError(f"Unsupported RHS: {type(rhs)}")
 
-    def _apply_binary_condition(self, cond: BinaryExpression, stream, is_first=False):
+    def _compile_condition(self, cond: BinaryExpression):
+        """
+        Return the compiled form of a binary condition, cached per statement.
+        """
+        cache = _compiled_conditions.get(self._statement)
+        if cache is None:
+            cache = _compiled_conditions[self._statement] = {}
+
+        compiled = cache.get(id(cond))
+        if compiled is None:
+            compiled = cache[id(cond)] = self._build_compiled_condition(cond)
+        return compiled
+
+    def _build_compiled_condition(self, cond: BinaryExpression):
         # Extract the Python value it's being compared to
         value = self._resolve_rhs(cond.right)
 
         col = cond.left
-        accessor = lambda obj, attr_name: getattr(obj, attr_name)
+        accessor = None
+        index_condition = None
 
         if isinstance(cond.left, FunctionElement):
             fn_name = cond.left.name.lower()
@@ -183,6 +516,7 @@ class MemoryQuery(Query):
             _class = FUNCTION_RESOLVERS[fn_name]
             _resolver = _class(clauses[1:])
             accessor = _resolver.accessor
+            index_condition = _resolver.index_condition(cond.operator, value, col)
 
         # Extract column name (LHS) and operator
         if not hasattr(col, "name"):
@@ -192,22 +526,98 @@ class MemoryQuery(Query):
         if table_name != self.tablename:
             raise NotImplementedError(f"Unsupported condition on other table: {table_name} vs {self.tablename}")
 
-        op = cond.operator
+        return CompiledCondition(
+            table_name, attr_name, cond.operator, value,
+            accessor=accessor, index_condition=index_condition
+        )
+
+    def _query_index(self, compiled: CompiledCondition, stream, is_first=False):
+        if compiled.index_operator is None:
+            return None
+
+        if not is_first:
+            fraction = self.store.index_manager.range_fraction(
+                compiled.table_name, compiled.attr_name, compiled.index_operator, compiled.index_value
+            )
+            if fraction is not None and fraction > RANGE_SCAN_THRESHOLD:
+                return None
+
+        return self.store.query_index(
+            stream, compiled.table_name, compiled.attr_name, compiled.index_operator, compiled.index_value,
+            collection_is_full_table=is_first
+        )
+
+    def _apply_binary_condition(self, cond: BinaryExpression, stream, is_first=False):
+        compiled = self._compile_condition(cond)
 
         # Use index if available
-        index_result = self.store.query_index(stream, table_name, attr_name, op, value, collection_is_full_table=is_first)
+        index_result = self._query_index(compiled, stream, is_first=is_first)
         if index_result is not None:
             return index_result
 
-        if op in OPERATOR_ADAPTERS:
-            op = OPERATOR_ADAPTERS[op](value)
+        return filter_rows([compiled], stream)
+
+    def _apply_conjunction(self, conditions, stream, is_first=False):
+        """
+        Apply AND-ed conditions to a stream.
+
+        Conditions are applied from the most to the least selective one, the cheapest
+        first when equally selective: index-backed conditions narrow the stream first,
+        then the remaining binary conditions are evaluated together by a single
+        generated filter.
+        """
+        conditions = list(conditions)
+
+        if len(conditions) > 1:
+            ranks = [self._get_condition_rank(cond) for cond in conditions]
+            for cond, (selectivity, _) in zip(conditions, ranks):
+                if selectivity == 0 and self._is_exact_index_miss(cond):
+                    # A condition matches no row
+                    return iter(())
+
+            order = sorted(range(len(conditions)), key=ranks.__getitem__)
+            conditions = [conditions[idx] for idx in order]
+
+        residual = []
+        others = []
+        for cond in conditions:
+            if not isinstance(cond, BinaryExpression):
+                others.append(cond)
+                continue
+
+            compiled = self._compile_condition(cond)
+            index_result = self._query_index(compiled, stream, is_first=is_first)
+            if index_result is None:
+                residual.append(compiled)
+            else:
+                stream = index_result
+                is_first = False
+
+        # Nested and_ / or_ may still start from the full table
+        for cond in others:
+            stream = self._apply_condition(cond, stream, is_first=is_first)
+            is_first = False
+
+        if residual:
+            stream = filter_rows(residual, stream)
+
+        return stream
+
+    def _is_exact_index_miss(self, cond):
+        """
+        True if a condition estimated to match no row is known to match none:
+        only the selectivity of equality and IN lookups is an exact count.
+        """
+        if not isinstance(cond, BinaryExpression):
+            return False
 
-        return (item for item in stream if op(accessor(item, attr_name), value))
+        compiled = self._compile_condition(cond)
+        return compiled.index_operator in (operators.eq, operators.in_op)
 
     def _apply_condition(self, cond, stream, is_first=False):
-        if isinstance(cond, Grouping):
-            # Unwrap
-            return self._apply_condition(cond.element, stream)
+        if isinstance(cond, False_):
+            # Folded WHERE FALSE
+            return iter(())
 
         if isinstance(cond, BinaryExpression):
             # Represent an expression that is ``LEFT <operator> RIGHT``
@@ -215,28 +625,30 @@ class MemoryQuery(Query):
 
         if isinstance(cond, BooleanClauseList):
             # and_ / or_ expressions
-            return self._apply_boolean_condition(cond, stream)
+            return self._apply_boolean_condition(cond, stream, is_first=is_first)
 
         raise NotImplementedError(f"Unsupported condition type: {type(cond)}")
 
     def _execute_query(self):
-        stream = iter(self.store.data.get(self.tablename, []))
-        if not stream:
+        data = self.store.data.get(self.tablename)
+        if not data:
             logger.debug(f"Table '{self.tablename}' is empty")
-            return []
+            return iter(())
+
+        stream = None
+        if len(self._where_criteria) == 1:
+            stream = self._primary_key_lookup(self._where_criteria[0])
 
-        # Apply conditions
-        conditions = sorted(self._where_criteria, key=self._get_condition_selectivity)
-        for idx, condition in enumerate(conditions):
-            stream = self._apply_condition(condition, stream, is_first=(idx == 0))
+        if stream is None:
+            stream = iter(data)
+
+            # Apply conditions
+            if self._where_criteria:
+                stream = self._apply_conjunction(self._where_criteria, stream, is_first=True)
 
         # Apply order by
         if self._order_by:
-            stream = list(stream)
-            for clause in reversed(self._order_by):
-                col = clause.element if isinstance(clause, UnaryExpression) else clause
-                reverse = isinstance(clause, UnaryExpression) and clause.modifier is operators.desc_op
-                stream = sorted(stream, key=lambda x: getattr(x, col.name), reverse=reverse)
+            stream = self._sort(stream)
 
         # Offset / limit
         if self._limit or self._offset:
@@ -246,6 +658,88 @@ class MemoryQuery(Query):
 
         return stream
 
+    def _primary_key_lookup(self, cond):
+        """
+        Rows matching a ``pk == value`` condition, read from the PK lookup dict,
+        or None if the condition is not one
+        """
+        if not isinstance(cond, BinaryExpression) or cond.operator is not operators.eq:
+            return None
+
+        compiled = self._compile_condition(cond)
+        if not compiled.indexable:
+            return None
+
+        if compiled.attr_name != self.store._get_primary_key_name(cond.left.table):
+            return None
+
+        row = self.store.data_by_pk[self.tablename].get(compiled.value)
+        return iter(() if row is None else (row,))
+
+    @cached_property
+    def _sort_keys(self):
+        """
+        ORDER BY clauses as a list of (column name, descending)
+        """
+        keys = []
+        for clause in self._order_by:
+            col = clause.element if isinstance(clause, UnaryExpression) else clause
+            reverse = isinstance(clause, UnaryExpression) and clause.modifier is operators.desc_op
+            keys.append((col.name, reverse))
+        return keys
+
+    def _sort(self, stream):
+        sort_keys = self._sort_keys
+
+        top = None
+        if self._limit:
+            top = (self._offset or 0) + self._limit
+
+        directions = {reverse for _, reverse in sort_keys}
+        if top is not None and top <= TOP_K_MAX:
+            # Only the first rows are needed: keep them in a heap while going
+            # through the stream, instead of sorting all of it
+            if len(directions) == 1:
+                key = make_sort_key(tuple(name for name, _ in sort_keys))
+                select = heapq.nlargest if directions.pop() else heapq.nsmallest
+                return select(top, stream, key=key)
+
+            # Mixed directions: most rows are compared once to the heap top,
+            # column by column
+            return heapq.nsmallest(top, stream, key=cmp_to_key(_compare_rows(sort_keys)))
+
+        stream = list(stream)
+        if len(directions) == 1:
+            # A single sort on all columns at once
+            stream.sort(key=make_sort_key(tuple(name for name, _ in sort_keys)), reverse=directions.pop())
+            return stream
+
+        # Mixed directions: stable sorts, from the last column to the first one
+        for name, reverse in reversed(sort_keys):
+            stream.sort(key=make_sort_key((name,)), reverse=reverse)
+        return stream
+
+    def _get_condition_rank(self, cond):
+        """
+        Sort key of a WHERE condition: (estimated selectivity, evaluation cost)
+        """
+        return self._get_condition_selectivity(cond), self._get_condition_cost(cond)
+
+    def _get_condition_cost(self, cond):
+        """
+        Static estimate of the cost of evaluating a condition on a row.
+        """
+        if isinstance(cond, BooleanClauseList):
+            return sum(self._get_condition_cost(clause) for clause in cond.clauses)
+
+        if not isinstance(cond, BinaryExpression):
+            return FUNCTION_COST
+
+        if isinstance(cond.left, FunctionElement):
+            return FUNCTION_COST
+
+        return OPERATOR_COSTS.get(cond.operator, FUNCTION_COST)
+
     def _get_condition_selectivity(self, cond):
         """
         Estimate the selectivity of a single WHERE condition.
@@ -255,25 +749,21 @@ class MemoryQuery(Query):
         is expected to filter out more rows (i.e., fewer rows remain after applying it),
         making it more selective.
         """
-        total_count = self.store.count(self.tablename)
+        total_count = self._table_count
 
         if not isinstance(cond, BinaryExpression):
             return total_count
 
-        col = cond.left
-        if isinstance(col, FunctionElement):
+        # Same resolution as when applying the condition, done once
+        compiled = self._compile_condition(cond)
+        if compiled.index_operator is None:
             return total_count
 
-        if not hasattr(col, "name"):
-            return total_count
-
-        value = self._resolve_rhs(cond.right)
-
         return self.store.index_manager.get_selectivity(
             tablename=self.tablename,
-            colname=col.name,
-            operator=cond.operator,
-            value=value,
+            colname=compiled.attr_name,
+            operator=compiled.index_operator,
+            value=compiled.index_value,
             total_count=total_count
         )
 
@@ -328,19 +818,28 @@ class MemoryQuery(Query):
         if not self.is_select:
             return stream
 
+        # Bypass projection if this is a simple SELECT [table]
+        if self.is_entity_select:
+            return stream
+
         cols = self._statement._raw_columns
         group_by = self._statement._group_by_clauses
 
-        # Bypass projection if this is a simple SELECT [table]
-        if not group_by and all(isinstance(c, (AnnotatedTable, DeclarativeMeta, Join)) for c in cols):
-            return stream
+        if self.is_count_select:
+            # Only references to the rows are gathered, to be counted
+            return [(len(list(stream)),)]
 
         if group_by or self._contains_aggregation_function(cols):
             grouped = {}
             if group_by:
-                for item in stream:
-                    key = tuple(getattr(item, col.name) for col in group_by)
-                    grouped.setdefault(key, []).append(item)
+                names = self._projected_column_names(group_by)
+                if names is not None:
+                    # Plain columns of the queried table: generated grouping
+                    grouped = group_rows(names, stream)
+                else:
+                    for item in stream:
+                        key = tuple(getattr(item, col.name) for col in group_by)
+                        grouped.setdefault(key, []).append(item)
             else:
                 grouped = {
                     "_all_": [item for item in stream]
@@ -356,11 +855,33 @@ class MemoryQuery(Query):
             return result
 
         else:
+            names = self._projected_column_names(cols)
+            if names is not None:
+                # Plain columns of the queried table: generated projection
+                return project_rows(names, stream)
+
             return (
                 tuple(self._evaluate_column(col, [item]) for col in cols)
                 for item in stream
             )
 
+    def _projected_column_names(self, cols):
+        """
+        Attribute names of the selected columns if they all are (labeled) columns
+        of the queried table, else None
+        """
+        names = []
+        for col in cols:
+            if isinstance(col, Label):
+                col = col.element
+
+            if not isinstance(col, AnnotatedColumn) or col.table.name != self.tablename:
+                return None
+
+            names.append(col.name)
+
+        return names
+
     def _contains_aggregation_function(self, cols):
         for c in cols:
             if isinstance(c, Label):
@@ -403,12 +924,13 @@ class MemoryQuery(Query):
 
         if isinstance(col, FunctionElement):
             fn_name = col.name.lower()
+            if fn_name == "count":
+                return self._evaluate_count(col, items)
+
             col_expr = next(iter(col.clauses))
             values = [getattr(item, col_expr.name) for item in items]
 
-            if fn_name == "count":
-                return len(values)
-            elif fn_name == "sum":
+            if fn_name == "sum":
                 return sum(values)
             elif fn_name == "min":
                 return min(values)
@@ -430,6 +952,32 @@ class MemoryQuery(Query):
 
         raise NotImplementedError(f"Column type not handled: {type(col)}")
 
+    def _evaluate_count(self, fn, items):
+        """
+        Evaluate count(...) over a group of items: NULL values are not counted.
+        """
+        if _counts_all_rows(fn):
+            return len(items)
+
+        clauses = list(fn.clauses)
+        if len(clauses) != 1:
+            raise NotImplementedError(f"Unsupported count() arguments: {clauses}")
+
+        arg = clauses[0]
+        distinct = isinstance(arg, UnaryExpression) and arg.operator is operators.distinct_op
+        if distinct:
+            arg = arg.element
+
+        if not isinstance(arg, AnnotatedColumn):
+            raise NotImplementedError(f"Unsupported count() argument: {arg}")
+
+        # Columns of a related model are read from it, as when selected
+        values = [self._evaluate_column(arg, [item]) for item in items]
+        values = [value for value in values if value is not None]
+        if distinct:
+            return len(set(values))
+        return len(values)
+
     def _evaluate_expression(self, expr, items):
         """
         Evaluate an expression (which might be a Grouping, BinaryExpression, BindParameter, etc.).
@@ -4,3 +4,11 @@ class FunctionResolver:
 
     def accessor(self, item, attr_name):
         raise NotImplementedError
+
+    def index_condition(self, operator, value, column):
+        """
+        Return the (operator, value) condition on the raw values of the column
+        equivalent to comparing the function result with the value, or None.
+        """
+        return None
+
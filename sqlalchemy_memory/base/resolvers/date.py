@@ -1,3 +1,6 @@
+from datetime import date, datetime, time
+from sqlalchemy.sql import operators
+
 from .abstract import FunctionResolver
 
 
@@ -5,3 +8,29 @@ class DateResolver(FunctionResolver):
     def accessor(self, item, attr_name):
         value = getattr(item, attr_name)
         return value.date() if value else None
+
+    def index_condition(self, operator, value, column):
+        # DATE(col) compared to a day is a range of the datetime values
+        if not isinstance(value, date) or isinstance(value, datetime):
+            return None
+
+        if getattr(column.type, "timezone", False):
+            # Naive bounds can't be compared to aware datetimes, and each value
+            # is a date in its own timezone
+            return None
+
+        start = datetime.combine(value, time.min)
+        end = datetime.combine(value, time.max)
+
+        if operator is operators.eq:
+            return operators.between_op, (start, end)
+        elif operator is operators.gt:
+            return operators.gt, end
+        elif operator is operators.ge:
+            return operators.ge, start
+        elif operator is operators.lt:
+            return operators.lt, start
+        elif operator is operators.le:
+            return operators.le, end
+
+        return None
@@ -2,20 +2,13 @@ from .abstract import FunctionResolver
 
 
 class JsonExtractResolver(FunctionResolver):
-    def _extract_json_value(self, data_dict, path):
-        # Traverse nested keys for a JSON path like 'ref.abc.xyz'
-        current = data_dict or {}
-        for key in path.split('.'):
-            if not isinstance(current, dict):
-                return None
-            current = current.get(key)
-            if current is None:
-                return None
-        return current
+    def __init__(self, clauses):
+        super().__init__(clauses)
 
-    def accessor(self, item, attr_name):
-        path_expr = self.clauses[0]
+        # The path is parsed once, not on every row
+        self.path_keys = self._parse_path(self.clauses[0])
 
+    def _parse_path(self, path_expr):
         raw = path_expr.value if hasattr(path_expr, 'value') else str(path_expr).strip('"')
 
         # Strip leading '$.' or '$'
@@ -26,4 +19,20 @@ class JsonExtractResolver(FunctionResolver):
         else:
             raw_path = raw
 
-        return self._extract_json_value(getattr(item, attr_name), raw_path)
+        return tuple(raw_path.split('.'))
+
+    def _extract_json_value(self, data_dict, path_keys):
+        # Traverse nested keys for a JSON path like ('ref', 'abc', 'xyz')
+        current = data_dict
+        for key in path_keys:
+            if not isinstance(current, dict):
+                return None
+            current = current.get(key)
+        return current
+
+    def accessor(self, item, attr_name):
+        data = getattr(item, attr_name)
+        if len(self.path_keys) == 1:
+            # Top-level key: a single lookup
+            return data.get(self.path_keys[0]) if isinstance(data, dict) else None
+        return self._extract_json_value(data, self.path_keys)
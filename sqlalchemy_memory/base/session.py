@@ -1,18 +1,50 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.sql.selectable import Select, SelectLabelStyle
 from sqlalchemy.sql.dml import Insert, Delete, Update
 from sqlalchemy.engine import IteratorResult, ChunkedIteratorResult
 from sqlalchemy.engine.cursor import SimpleResultMetaData
 from sqlalchemy.sql.annotation import AnnotatedTable
-from functools import partial
+from functools import lru_cache, partial
+from weakref import WeakKeyDictionary
 
-from unittest.mock import MagicMock
 
 from .query import MemoryQuery
+from .codegen import project_rows
 from .pending_changes import PendingChanges
 from ..logger import logger
 from ..helpers.utils import chunk_generator
 
+# INSERT statement => (model class, VALUES(...) dict)
+_insert_plans = WeakKeyDictionary()
+
+
+@lru_cache(maxsize=1024)
+def _metadata_for_names(names):
+    """
+    Result metadata for a tuple of column names, shared by the results of a
+    same shape instead of rebuilding its key maps for every statement
+    """
+    return SimpleResultMetaData(list(names))
+
+
+@lru_cache(maxsize=1024)
+def _merged_columns(table):
+    """
+    Names of the columns of a table copied by merge(): all but the primary key
+    """
+    return tuple(column.name for column in table.columns if not column.primary_key)
+
+
+def _rowcount_result(rowcount):
+    """
+    Row-less result of a DML statement, sharing the empty metadata
+    """
+    result = IteratorResult(_metadata_for_names(()), iter(()))
+    result.rowcount = rowcount
+    return result
+
+
 class MemorySession(Session):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -26,8 +58,7 @@ class MemorySession(Session):
         self.pending_changes.add(obj, **kwargs)
 
     def add_all(self, instances, **kwargs):
-        for instance in instances:
-            self.add(instance, **kwargs)
+        self.pending_changes.add_all(instances)
 
     def delete(self, obj):
         self.pending_changes.delete(obj)
@@ -49,10 +80,10 @@ class MemorySession(Session):
 
     @staticmethod
     def _get_metadata_from_columns(columns):
-        return SimpleResultMetaData([
+        return _metadata_for_names(tuple(
             getattr(col, "name", str(col))
             for col in columns
-        ])
+        ))
 
     def _handle_select(self, statement: Select, **kwargs):
         # Execute the query
@@ -68,47 +99,44 @@ class MemorySession(Session):
             Support for legacy session.query(...) style
             """
             it = IteratorResult(metadata, results)
-            it._real_result = MagicMock(_source_supports_scalars=True)
+            # Rows are the instances themselves, served as scalars
+            it._source_supports_scalars = True
             it._generate_rows = False
             return it
 
-        it = ChunkedIteratorResult(metadata, partial(chunk_generator, results))
+        if q.is_entity_select:
+            # 1-tuple rows, built (in C) as they are fetched
+            rows = zip(results)
+        else:
+            rows = iter(results)
+
+        it = ChunkedIteratorResult(metadata, partial(chunk_generator, rows))
 
         return it
 
 
     def _handle_delete(self, statement: Delete, **kwargs):
-        collection = MemoryQuery(statement, self).all()
-
-        for obj in collection:
+        # Matching rows are streamed: deletes are only queued until the commit
+        rowcount = 0
+        for obj in MemoryQuery(statement, self).iter_items():
             self.delete(obj)
+            rowcount += 1
 
-        result = IteratorResult(SimpleResultMetaData([]), iter([]))
-        result.rowcount = len(collection)
-        return result
+        return _rowcount_result(rowcount)
 
     def _handle_insert(self, statement: Insert, params=None, **kwargs):
+        model, values = self._get_insert_plan(statement)
+
         # Determine list of value-dicts to insert
         if params is None:
-            vals_list = [
-                {
-                    col.name: (val.value if hasattr(val, "value") else val)
-                    for col, val in statement._values.items()
-                }
-            ]
+            vals_list = [values]
         elif isinstance(params, list):
             vals_list = params
         else:
             vals_list = [params]
 
-        mapper = statement.table._annotations["parentmapper"]
-        model = mapper.class_
-
-        instances = []
-        for vals in vals_list:
-            obj = model(**vals)
-            self.add(obj)
-            instances.append(obj)
+        instances = [model(**vals) for vals in vals_list]
+        self.add_all(instances)
 
         rowcount = len(instances)
 
@@ -116,18 +144,31 @@ class MemorySession(Session):
         if statement._returning:
             cols = list(statement._returning)
             metadata = self._get_metadata_from_columns(cols)
-            rows = [
-                tuple(getattr(obj, col.name) for col in cols)
-                for obj in instances
-            ]
-            return IteratorResult(metadata, iter(rows))
+            # Read with the generated projection, as for SELECT
+            rows = project_rows([col.name for col in cols], instances)
+            return IteratorResult(metadata, rows)
 
-        result = IteratorResult(SimpleResultMetaData([]), iter([]))
-        result.rowcount = rowcount
-        return result
+        return _rowcount_result(rowcount)
 
-    def _handle_update(self, statement: Update, **kwargs):
-        collection = MemoryQuery(statement, self).all()
+    @staticmethod
+    def _get_insert_plan(statement: Insert):
+        """
+        Model class and VALUES(...) of an INSERT statement, read once per statement
+        """
+        plan = _insert_plans.get(statement)
+        if plan is None:
+            model = statement.table._annotations["parentmapper"].class_
+            values = {
+                col.name: (val.value if hasattr(val, "value") else val)
+                for col, val in statement._values.items()
+            } if statement._values else {}
+            plan = _insert_plans[statement] = (model, values)
+
+        return plan
+
+    def _handle_update(self, statement: Update, params=None, **kwargs):
+        if params is not None and not statement._where_criteria and not statement._values:
+            return self._handle_bulk_update(statement, params)
 
         data = {
             col.name: bindparam.value
@@ -135,32 +176,69 @@ class MemorySession(Session):
         }
 
         tablename = statement.table.name
-        pk_col_name = None
-        for obj in collection:
-            if pk_col_name is None:
-                pk_col_name = self.store._get_primary_key_name(obj.__table__)
+        pk_col_name = self.store._get_primary_key_name(statement.table)
 
+        # Matching rows are streamed: updates are only queued until the commit
+        rowcount = 0
+        for obj in MemoryQuery(statement, self).iter_items():
             pk_value = getattr(obj, pk_col_name)
             self.update(tablename, pk_value, data)
+            rowcount += 1
 
-        result = IteratorResult(SimpleResultMetaData([]), iter([]))
-        result.rowcount = len(collection)
-        return result
+        return _rowcount_result(rowcount)
 
-    def execute(self, statement, params=None, **kwargs):
-        if isinstance(statement, Select):
-            return self._handle_select(statement, **kwargs)
+    def _handle_bulk_update(self, statement: Update, params):
+        """
+        ORM bulk UPDATE by primary key: session.execute(update(Model), [{pk, values...}, ...])
+        """
+        if isinstance(params, dict):
+            params = [params]
+
+        table = statement.table
+        tablename = table.name
+        pk_col_name = self.store._get_primary_key_name(table)
+        rows_by_pk = self.store.data_by_pk.get(tablename, {})
+
+        # Checked before queuing any update, as SQLAlchemy does
+        for mapping in params:
+            if pk_col_name not in mapping:
+                raise InvalidRequestError(
+                    f"No primary key value supplied for column(s) {tablename}.{pk_col_name}; "
+                    "per-row ORM Bulk UPDATE by Primary Key requires that records contain primary key values"
+                )
+
+        rowcount = 0
+        for mapping in params:
+            data = dict(mapping)
+            pk_value = data.pop(pk_col_name)
+            if pk_value not in rows_by_pk:
+                continue
 
-        elif isinstance(statement, Delete):
-            return self._handle_delete(statement, **kwargs)
+            self.update(tablename, pk_value, data)
+            rowcount += 1
 
-        elif isinstance(statement, Insert):
-            return self._handle_insert(statement, params=params, **kwargs)
+        return _rowcount_result(rowcount)
 
-        elif isinstance(statement, Update):
-            return self._handle_update(statement, **kwargs)
+    # Statement type => handler
+    _statement_handlers = {
+        Select: _handle_select,
+        Delete: _handle_delete,
+        Insert: _handle_insert,
+        Update: _handle_update,
+    }
 
-        raise Exception(f"Statement not handled: {statement} {type(statement)}")
+    def execute(self, statement, params=None, **kwargs):
+        handler = self._statement_handlers.get(type(statement))
+        if handler is None:
+            # Subclass of a statement type
+            for statement_type, statement_handler in self._statement_handlers.items():
+                if isinstance(statement, statement_type):
+                    handler = statement_handler
+                    break
+            else:
+                raise Exception(f"Statement not handled: {statement} {type(statement)}")
+
+        return handler(self, statement, params=params, **kwargs)
 
     def merge(self, instance, **kwargs):
         """
@@ -172,14 +250,14 @@ class MemorySession(Session):
         existing = self.store.get_by_primary_key(instance, pk_value)
 
         if existing:
-            self._has_pending_merge = True
-
-            for column in instance.__table__.columns:
-                field = column.name
-                if field == pk_name:
-                    continue
+            for field in _merged_columns(instance.__table__):
                 value = getattr(instance, field)
+                if getattr(existing, field) == value:
+                    # Unchanged: no write, nothing to commit
+                    continue
+
                 setattr(existing, field, value)
+                self._has_pending_merge = True
 
             return existing
 
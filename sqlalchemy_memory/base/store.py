@@ -1,12 +1,25 @@
 from collections import defaultdict
-from sqlalchemy import func
+from sqlalchemy.sql.functions import now
 from sqlalchemy.sql.elements import TextClause
-from sqlalchemy.orm.attributes import NEVER_SET, NO_VALUE, LoaderCallableStatus
-from datetime import datetime
+from sqlalchemy.orm.attributes import NEVER_SET, NO_VALUE, LoaderCallableStatus, set_committed_value
+from datetime import datetime, timezone
+from functools import partial
+from itertools import filterfalse
+import logging
 
 from ..logger import logger
 from .pending_changes import PendingChanges
 from .indexes import IndexManager
+from .codegen import make_updater
+
+def _utcnow():
+    # Naive UTC datetime, as func.now() returns
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _unhandled_server_default(server_default):
+    raise Exception(f"Unhandled server_default type: {type(server_default)}")
+
 
 class InMemoryStore:
     def __init__(self):
@@ -27,6 +40,7 @@ class InMemoryStore:
         # Caches
         self.table_columns = {}
         self.table_pk_name = {}
+        self.table_defaults = {}
 
     @property
     def dirty(self):
@@ -40,62 +54,46 @@ class InMemoryStore:
             if not objs:
                 continue
 
-            data = self.data.get(tablename, [])
             pk_col_name = self._get_primary_key_name(objs[0].__table__)
 
             pk_values = set(getattr(obj, pk_col_name) for obj in objs)
             logger.debug(f"Deleting rows from table '{tablename}' with PK values={pk_values}")
 
-            # Delete from table data
-            self.data[tablename] = [
-                row
-                for row in data
-                if getattr(row, pk_col_name) not in pk_values
-            ]
-            # Delete from PK lookup dict
-            for pk_value in pk_values:
-                del self.data_by_pk[tablename][pk_value]
+            # Delete from PK lookup dict, gathering the stored rows
+            rows_by_pk = self.data_by_pk[tablename]
+            deleted = {rows_by_pk.pop(pk_value): None for pk_value in pk_values}
+
+            # Delete from table data: a new list, so that queries iterating over the
+            # current one are not affected
+            self.data[tablename] = list(filterfalse(deleted.__contains__, self.data[tablename]))
 
             # Update indexes
-            for obj in objs:
-                self.index_manager.on_delete(obj)
+            self.index_manager.on_delete_many(objs)
 
         # apply adds
-        added = set()
         for tablename, objs in self.pending_changes._to_add.items():
-            if tablename not in self.data:
-                self.data[tablename] = []
-
-            for obj in objs:
-                if id(obj) in added:
-                    continue
-                added.add(id(obj))
-
-                pk_value = self._assign_primary_key_if_needed(obj)
-                if pk_value in self.data_by_pk[tablename].keys():
-                    raise Exception(f"Cannot have duplicate PK value {pk_value} for table '{tablename}'")
-
-                self._apply_column_defaults(obj)
-
-                logger.debug(f"Adding {obj} to table '{tablename}'")
-
-                self.data[tablename].append(obj)
-                self.data_by_pk[tablename][pk_value] = obj
-                self.index_manager.on_insert(obj)
+            self.bulk_insert(tablename, objs.values())
 
         # apply updates
+        debug = logger.isEnabledFor(logging.DEBUG)
         for tablename, updates in self.pending_changes._to_update.items():
+            rows_by_pk = self.data_by_pk[tablename]
+            last_data = None
             for pk_value, data in updates:
-                if pk_value not in self.data_by_pk[tablename].keys():
+                item = rows_by_pk.get(pk_value)
+                if item is None:
                     raise Exception(f"Could not find item with PK value {pk_value} in table '{tablename}'")
 
-                logger.debug(f"Updating table '{tablename}' where PK value={pk_value}: {data}")
-                item = self.data_by_pk[tablename][pk_value]
+                if debug:
+                    logger.debug(f"Updating table '{tablename}' where PK value={pk_value}: {data}")
+
+                if data is not last_data:
+                    # Rows of an UPDATE statement share the same values
+                    last_data = data
+                    update = make_updater(tuple(data))
+                    new_values = tuple(data.values())
 
-                values = {}
-                for k, v in data.items():
-                    values[k] = dict(old=getattr(item, k), new=v)
-                    setattr(item, k, v)
+                values = update(item, *new_values)
 
                 # Update indexes
                 self.index_manager.on_update(item, values)
@@ -103,14 +101,47 @@ class InMemoryStore:
         self.pending_changes.clear()
 
     def rollback(self):
-        # Revert attributes changes
-        for updates in self.pending_changes._modifications.values():
-            instance = updates.pop("__instance")
-            for colname, (old_value, new_value) in updates.items():
-                setattr(instance, colname, old_value)
+        # Revert attributes changes from their before-image, without going
+        # through the change tracking listener
+        for (_, colname), (instance, old_value, _) in self.pending_changes._modifications.items():
+            set_committed_value(instance, colname, old_value)
 
         self.pending_changes.rollback()
 
+    def bulk_insert(self, tablename, objs):
+        """
+        Insert new objects into a table, along with their PK lookup and index entries.
+        """
+        rows_by_pk = self.data_by_pk[tablename]
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        inserted = []
+        try:
+            pk_col_name = None
+            for obj in objs:
+                if pk_col_name is None:
+                    pk_col_name = self._get_primary_key_name(obj.__table__)
+
+                pk_value = self._assign_primary_key_if_needed(obj, pk_col_name)
+                if pk_value in rows_by_pk:
+                    raise Exception(f"Cannot have duplicate PK value {pk_value} for table '{tablename}'")
+
+                self._apply_column_defaults(obj)
+
+                if debug:
+                    logger.debug(f"Adding {obj} to table '{tablename}'")
+
+                rows_by_pk[pk_value] = obj
+                inserted.append(obj)
+
+        finally:
+            # Rows and index entries are added for the whole batch at once,
+            # including the rows preceding an error. Like deletes, this makes a
+            # new list, so that queries iterating over the current one are not affected
+            if inserted:
+                self.data[tablename] = self.data[tablename] + inserted
+            self.index_manager.on_insert_many(inserted)
+
     def get_by_primary_key(self, entity, pk_value):
         tablename = entity.__tablename__
         if tablename not in self.data_by_pk:
@@ -122,17 +153,17 @@ class InMemoryStore:
         """
         Return the PK column name
         """
-        tablename = table.name
-        if tablename not in self.table_pk_name:
+        pk_col_name = self.table_pk_name.get(table.name)
+        if pk_col_name is None:
             pk_cols = table.primary_key.columns
 
             if len(pk_cols) != 1:
                 raise NotImplementedError("Only single-column primary keys are supported.")
 
             col = list(pk_cols)[0]
-            self.table_pk_name[tablename] = col.name
+            pk_col_name = self.table_pk_name[table.name] = col.name
 
-        return self.table_pk_name[tablename]
+        return pk_col_name
 
     def _get_table_columns(self, table):
         """
@@ -144,13 +175,14 @@ class InMemoryStore:
 
         return self.table_columns[tablename]
 
-    def _assign_primary_key_if_needed(self, obj):
+    def _assign_primary_key_if_needed(self, obj, pk_col_name=None):
         """
         Handle auto-increment primary keys.
         If user specifies an ID, use it and update the counter if necessary.
         If no ID is specified, assign the next available one.
         """
-        pk_col_name = self._get_primary_key_name(obj.__table__)
+        if pk_col_name is None:
+            pk_col_name = self._get_primary_key_name(obj.__table__)
         current_id = obj.__dict__.get(pk_col_name, None)
         tablename = obj.__tablename__
 
@@ -165,42 +197,51 @@ class InMemoryStore:
 
         return current_id
 
-    def _apply_column_defaults(self, obj):
+    def _get_column_defaults(self, table):
         """
-        Apply default and server_default values to an ORM object.
+        Returns the defaults of the table columns, classified once per table,
+        as a list of (attribute name, value, factory): the factory, if any,
+        is called for each row to produce the value
         """
+        tablename = table.name
+        defaults = self.table_defaults.get(tablename)
+        if defaults is not None:
+            return defaults
+
+        defaults = []
+        for column in self._get_table_columns(table):
+            if column.default is not None:
+                arg = column.default.arg
+                if callable(arg):
+                    # SQLAlchemy wraps callable defaults to take the execution context
+                    defaults.append((column.name, None, partial(arg, None)))
+                else:
+                    defaults.append((column.name, arg, None))
 
-        for column in self._get_table_columns(obj.__table__):
-            if column.default is None and column.server_default is None:
-                continue
-
-            attr_name = column.name
-            current_value = getattr(obj, attr_name, None)
+            elif column.server_default is not None:
+                arg = column.server_default.arg
+                if isinstance(arg, TextClause):
+                    defaults.append((column.name, arg.text, None))
 
-            if current_value is not None:
-                continue
+                elif isinstance(arg, now):
+                    defaults.append((column.name, None, _utcnow))
 
-            elif column.default is not None:
-                if callable(column.default.arg):
-                    try:
-                        value = column.default.arg()
-                    except TypeError:
-                        value = column.default.arg(ctx=None)
                 else:
-                    value = column.default.arg
+                    defaults.append((column.name, None, partial(_unhandled_server_default, column.server_default)))
 
-                obj.__dict__[attr_name] = value
+        self.table_defaults[tablename] = defaults
+        return defaults
 
-            elif column.server_default is not None:
-                if isinstance(column.server_default.arg, TextClause):
-                    text_value = column.server_default.arg.text
-                    obj.__dict__[attr_name] = text_value
-
-                elif isinstance(column.server_default.arg, func.now().__class__):
-                    obj.__dict__[attr_name] = datetime.utcnow()
+    def _apply_column_defaults(self, obj):
+        """
+        Apply default and server_default values to an ORM object.
+        """
+        row = obj.__dict__
+        for attr_name, value, factory in self._get_column_defaults(obj.__table__):
+            if row.get(attr_name) is not None:
+                continue
 
-                else:
-                    raise Exception(f"Unhandled server_default type: {type(column.server_default)}")
+            row[attr_name] = factory() if factory is not None else value
 
     def query_index(self, stream, table_name, attr_name, op, value, **kwargs):
         return self.index_manager.query(stream, table_name, attr_name, op, value, **kwargs)
@@ -210,19 +251,10 @@ class InMemoryStore:
 
     def update_modified_items_indexes(self):
         # update indexes of modified objects
-        for updates in self.pending_changes._modifications.values():
-            instance = updates.pop("__instance")
-
-            values = {
-                colname: dict(old=old_value, new=new_value)
-                for colname, (old_value, new_value) in updates.items()
-                if old_value != new_value
-            }
-            if not values:
-                continue
-
-            # Update indexes
-            self.index_manager.on_update(instance, values)
+        on_update = self.index_manager.on_update
+        for (_, colname), (instance, old_value, new_value) in self.pending_changes._modifications.items():
+            if old_value != new_value:
+                on_update(instance, {colname: dict(old=old_value, new=new_value)})
 
     def _track_field_change_listener(self, target, value, oldvalue, initiator):
         if oldvalue in (NO_VALUE, NEVER_SET, LoaderCallableStatus.NO_VALUE):
@@ -1,20 +1,28 @@
-from itertools import chain
+from itertools import chain, islice
 
 def _dedup_chain(*streams):
     """
-    Lazily merge multiple input iterators, yielding unique items only.
+    Merge multiple input iterators, yielding unique items only.
 
-    This function performs a streamed union of all provided iterators,
-    ensuring that each item is yielded at most once while preserving order
-    across the combined streams.
+    The union is built in C with dict.fromkeys, which keeps the order in which
+    items are first seen across the combined streams.
     """
-    seen = set()
-    for item in chain(*streams):
-        if item not in seen:
-            seen.add(item)
-            yield item
+    return iter(dict.fromkeys(chain(*streams)))
 
 
-def chunk_generator(results, *a):
-    chunk = [(r,) if not isinstance(r, (list, tuple)) else r for r in results]
-    yield chunk
+def chunk_generator(rows, size=None):
+    """
+    Chunks of rows for a ChunkedIteratorResult.
+
+    When all rows are requested (no size), the single chunk is the rows iterator
+    itself, so that fetching the first rows doesn't consume the whole result.
+    """
+    if size is None:
+        yield rows
+        return
+
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
@@ -1,5 +1,5 @@
 from sqlalchemy.orm import declarative_base, mapped_column, Mapped, relationship
-from sqlalchemy import JSON, func, text, ForeignKey
+from sqlalchemy import JSON, DateTime, func, text, ForeignKey
 from datetime import datetime
 from typing import List
 
@@ -52,9 +52,20 @@ class ProductWithIndex(Base):
     name: Mapped[str] = mapped_column(nullable=False)
     category: Mapped[str] = mapped_column(index=True, nullable=False)
     price: Mapped[float] = mapped_column(default=True, index=True)
+    created_at: Mapped[datetime] = mapped_column(nullable=True, index=True)
 
     vendor_id: Mapped[int] = mapped_column(ForeignKey("vendors.id"), index=True)
     vendor: Mapped["Vendor"] = relationship(back_populates="products")
 
     def __repr__(self):
         return f"ProductWithIndex(id={self.id} name={self.name})"
+
+
+class Event(Base):
+    __tablename__ = "events"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column()
+    occurred_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True, nullable=True)
+
+    def __repr__(self):
+        return f"Event(id={self.id} name={self.name})"
@@ -1,10 +1,12 @@
-from sqlalchemy import select, func, and_, or_, not_, case
+from sqlalchemy import select, delete, func, and_, or_, not_, case, true, false
 from sqlalchemy.orm import joinedload, selectinload
-from datetime import datetime, date
+from datetime import datetime, date, timedelta, timezone
 from sqlalchemy.sql.annotation import AnnotatedTable
 import pytest
 
-from models import Item, Product, ProductWithIndex, Vendor
+from sqlalchemy_memory.base.query import MemoryQuery
+
+from models import Event, Item, Product, ProductWithIndex, Vendor
 
 class TestAdvanced:
     @pytest.mark.parametrize(
@@ -16,6 +18,10 @@ class TestAdvanced:
             ("foo", False, {1}),  # exactly foo
             ("%baz%", False, set()),  # no match
             ("%foo%", True, {2}),  # NOT LIKE contains foo
+            ("f_o", False, {1}),  # single character wildcard
+            ("%o_a%", False, {3}),  # wildcards in the middle
+            ("%", False, {1, 2, 3, 4}),  # anything
+            ("bar%", True, {1, 3}),  # NOT LIKE starts with bar
         ]
     )
     def test_like_patterns(self, SessionFactory, pattern, negate, expected_ids):
@@ -197,6 +203,64 @@ class TestAdvanced:
             results = session.execute(stmt).scalars().all()
             assert {item.id for item in results} == expected_ids
 
+    @pytest.mark.parametrize(
+        "operator, value, expected_ids",
+        [
+            ("==", date(2025, 1, 2), {2, 3}),
+            (">", date(2025, 1, 2), {4}),
+            (">=", date(2025, 1, 2), {2, 3, 4}),
+            ("<", date(2025, 1, 2), {1}),
+            ("<=", date(2025, 1, 2), {1, 2, 3}),
+            ("==", date(2025, 1, 10), set()),
+        ]
+    )
+    def test_date_filter_indexed(self, SessionFactory, operator, value, expected_ids):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="A", created_at=datetime(2025, 1, 1, 23, 59, 59)),
+                ProductWithIndex(id=2, name="bar", category="A", created_at=datetime(2025, 1, 2)),
+                ProductWithIndex(id=3, name="foobar", category="A", created_at=datetime(2025, 1, 2, 23, 59, 59, 999999)),
+                ProductWithIndex(id=4, name="barfoo", category="A", created_at=datetime(2025, 1, 3)),
+                ProductWithIndex(id=5, name="baz", category="A", created_at=None),
+            ])
+            session.commit()
+
+            column = func.DATE(ProductWithIndex.created_at)
+            condition = {
+                "==": column == value,
+                ">": column > value,
+                ">=": column >= value,
+                "<": column < value,
+                "<=": column <= value,
+            }[operator]
+
+            results = session.execute(select(ProductWithIndex).where(condition)).scalars().all()
+            assert {item.id for item in results} == expected_ids
+
+            # Also when narrowing the stream of another condition
+            stmt = select(ProductWithIndex).where(ProductWithIndex.category == "A", condition)
+            results = session.execute(stmt).scalars().all()
+            assert {item.id for item in results} == expected_ids
+
+    def test_date_filter_timezone_aware(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                Event(id=1, name="foo", occurred_at=datetime(2025, 1, 1, 23, 0, tzinfo=timezone.utc)),
+                Event(id=2, name="bar", occurred_at=datetime(2025, 1, 2, 1, 0, tzinfo=timezone(timedelta(hours=2)))),
+                Event(id=3, name="baz", occurred_at=datetime(2025, 1, 3, tzinfo=timezone.utc)),
+                Event(id=4, name="qux", occurred_at=None),
+            ])
+            session.commit()
+
+            column = func.DATE(Event.occurred_at)
+            for condition, expected_ids in [
+                (column == date(2025, 1, 2), [2]),
+                (column > date(2025, 1, 1), [2, 3]),
+                (column <= date(2025, 1, 2), [1, 2]),
+            ]:
+                results = session.execute(select(Event).where(condition)).scalars().all()
+                assert [item.id for item in results] == expected_ids
+
     @pytest.mark.parametrize("condition,expected_ids", [
         (
             (Product.id > 1) & ((Product.id < 4) | (Product.category == "A")),
@@ -366,3 +430,320 @@ class TestAdvanced:
                 for k, v in expected_result.items():
                     assert hasattr(result, k), f"Expected {k} to be in result, but keys are {result.__dict__.keys()}"
                     assert getattr(result, k) == v, f"Expected {k} to be == {v} for item #{idx}"
+
+    def test_reexecute_statement(self, SessionFactory):
+        stmt = select(ProductWithIndex).where(
+            ProductWithIndex.category == "A",
+            ProductWithIndex.name.like("foo%"),
+        )
+
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="A", vendor_id=10),
+                ProductWithIndex(id=2, name="bar", category="A", vendor_id=10),
+            ])
+            session.commit()
+
+            results = session.execute(stmt).scalars().all()
+            assert {item.id for item in results} == {1}
+
+            session.add(ProductWithIndex(id=3, name="foobar", category="A", vendor_id=20))
+            item = session.get(ProductWithIndex, 1)
+            item.category = "B"
+            session.commit()
+
+            # Same statement object: compiled conditions are reused, data is not
+            results = session.execute(stmt).scalars().all()
+            assert {item.id for item in results} == {3}
+
+    def test_fused_filter(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                Product(id=1, name="foo", category="A", active=True),
+                Product(id=2, name="foobar", category="A", active=True),
+                Product(id=3, name="foobaz", category="B", active=False),
+                Product(id=4, name="bar", category="A", active=True),
+            ])
+            session.commit()
+
+            def ids(*conditions):
+                return {item.id for item in session.execute(select(Product).where(*conditions)).scalars()}
+
+            # Plain comparisons and opaque predicates evaluated in the same pass
+            assert ids(Product.category == "A", Product.id >= 2, Product.name.like("foo%")) == {2}
+            # Same shape, different values
+            assert ids(Product.category == "B", Product.id >= 1, Product.name.like("foo%")) == {3}
+            assert ids(Product.active.is_(True), Product.id.between(2, 4), Product.category != "B") == {2, 4}
+            # Both bounds of a column compared at once
+            assert ids(Product.name > "bar", Product.category == "A", Product.name <= "foobar") == {1, 2}
+            assert ids(Product.name < "foobaz", Product.name >= "foo", Product.name < "g") == {1, 2}
+
+    def test_unmatched_condition(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="A", vendor_id=10),
+                ProductWithIndex(id=2, name="bar", category="B", vendor_id=10),
+            ])
+            session.commit()
+
+            stmt = select(ProductWithIndex).where(
+                ProductWithIndex.name.like("%o%"),
+                or_(
+                    and_(ProductWithIndex.category == "Z", ProductWithIndex.id > 0),
+                    and_(ProductWithIndex.vendor_id == 10, ProductWithIndex.category == "A"),
+                ),
+            )
+            results = session.execute(stmt).scalars().all()
+            assert [item.id for item in results] == [1]
+
+    def test_range_on_null_values(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="A", vendor_id=10, created_at=datetime(2025, 1, 1)),
+                ProductWithIndex(id=2, name="bar", category="A", vendor_id=10),
+                ProductWithIndex(id=3, name="baz", category="A", vendor_id=10, created_at=datetime(2025, 3, 1)),
+                ProductWithIndex(id=4, name="qux", category="B", vendor_id=10, created_at=datetime(2025, 2, 1)),
+            ])
+            session.commit()
+
+            created_at = ProductWithIndex.created_at
+            conditions = [
+                (created_at > datetime(2024, 1, 1), [1, 3, 4]),
+                (created_at <= datetime(2026, 1, 1), [1, 3, 4]),
+                (created_at.between(datetime(2024, 1, 1), datetime(2026, 1, 1)), [1, 3, 4]),
+                (~created_at.between(datetime(2025, 1, 15), datetime(2025, 2, 15)), [1, 3]),
+                (func.DATE(created_at) > date(2024, 1, 1), [1, 3, 4]),
+            ]
+            for condition, expected_ids in conditions:
+                # Served by the index
+                stmt = select(ProductWithIndex).where(condition)
+                assert sorted(item.id for item in session.execute(stmt).scalars()) == expected_ids
+
+                # Scanned over the stream narrowed by the category
+                stmt = select(ProductWithIndex).where(ProductWithIndex.category == "A", condition)
+                assert [item.id for item in session.execute(stmt).scalars()] == [i for i in expected_ids if i != 4]
+
+                # Evaluated together with other conditions
+                stmt = select(ProductWithIndex).where(ProductWithIndex.name != "zz", condition, ProductWithIndex.id > 0)
+                assert sorted(item.id for item in session.execute(stmt).scalars()) == expected_ids
+
+            stmt = select(ProductWithIndex).where(created_at > datetime(2024, 1, 1), created_at < datetime(2026, 1, 1))
+            assert sorted(item.id for item in session.execute(stmt).scalars()) == [1, 3, 4]
+
+    def test_not_in_duplicate_values(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="A", vendor_id=10),
+                ProductWithIndex(id=2, name="bar", category="B", vendor_id=10),
+            ])
+            session.commit()
+
+            stmt = select(ProductWithIndex).where(
+                ProductWithIndex.category.not_in(["A", "A"]),
+                ProductWithIndex.name != "zz",
+            )
+            assert [item.id for item in session.execute(stmt).scalars()] == [2]
+
+            stmt = select(ProductWithIndex).where(
+                ProductWithIndex.category.in_(["B", "B"]),
+                ProductWithIndex.name != "zz",
+            )
+            assert [item.id for item in session.execute(stmt).scalars()] == [2]
+
+            # Exact index miss: nothing to scan
+            stmt = select(ProductWithIndex).where(
+                ProductWithIndex.category.in_(["Z"]),
+                ProductWithIndex.name != "zz",
+            )
+            assert session.execute(stmt).scalars().all() == []
+
+    def test_or_on_narrowed_stream(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="A", vendor_id=10),
+                ProductWithIndex(id=2, name="bar", category="B", vendor_id=10),
+                ProductWithIndex(id=3, name="foobar", category="B", vendor_id=20),
+                ProductWithIndex(id=4, name="baz", category="C", vendor_id=10),
+            ])
+            session.commit()
+
+            stmt = select(ProductWithIndex).where(
+                ProductWithIndex.vendor_id == 10,
+                or_(
+                    ProductWithIndex.category == "B",
+                    ProductWithIndex.name.like("f%"),
+                    and_(ProductWithIndex.id > 3, ProductWithIndex.category == "B"),
+                ),
+            )
+            results = session.execute(stmt).scalars().all()
+            assert [item.id for item in results] == [1, 2]
+
+    def test_commit_while_iterating(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=i, name="foo", category="A", price=i, vendor_id=10)
+                for i in range(1, 6)
+            ])
+            session.commit()
+
+            for stmt in (
+                select(ProductWithIndex).where(ProductWithIndex.category == "A"),
+                select(ProductWithIndex).where(ProductWithIndex.price > 0),
+            ):
+                for item in session.execute(stmt).scalars():
+                    item.category = "B" if item.category == "A" else "A"
+                    item.price += 10
+                    session.commit()
+
+            results = session.execute(
+                select(ProductWithIndex).where(ProductWithIndex.category == "A")
+            ).scalars().all()
+            assert [item.id for item in results] == [1, 2, 3, 4, 5]
+
+    def test_insert_while_iterating(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=i, name="foo", category="A", price=i, vendor_id=10)
+                for i in range(1, 6)
+            ])
+            session.commit()
+
+            new_ids = iter(range(100, 1000))
+            for stmt in (
+                select(ProductWithIndex),
+                select(ProductWithIndex).where(ProductWithIndex.category == "A"),
+                select(ProductWithIndex).where(ProductWithIndex.price > 0),
+                select(ProductWithIndex).where(ProductWithIndex.price.between(0, 10)),
+                select(ProductWithIndex).where(ProductWithIndex.name == "foo", ProductWithIndex.vendor_id == 10),
+            ):
+                # Rows committed while iterating, including ones sharing the
+                # indexed values of rows still to come, are not part of the result
+                ids = []
+                for item in session.execute(stmt).scalars():
+                    ids.append(item.id)
+                    session.add_all([
+                        ProductWithIndex(id=next(new_ids), name="foo", category="A", price=price, vendor_id=10)
+                        for price in (4, 5)
+                    ])
+                    session.commit()
+
+                assert ids == [1, 2, 3, 4, 5]
+                session.execute(delete(ProductWithIndex).where(ProductWithIndex.id >= 100))
+                session.commit()
+
+    def test_order_by_limit(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="B", price=20, vendor_id=10),
+                ProductWithIndex(id=2, name="bar", category="A", price=10, vendor_id=10),
+                ProductWithIndex(id=3, name="baz", category="B", price=10, vendor_id=20),
+                ProductWithIndex(id=4, name="qux", category="A", price=30, vendor_id=20),
+            ])
+            session.commit()
+
+            def ids(*order_by, limit=None, offset=None):
+                stmt = select(ProductWithIndex).order_by(*order_by).limit(limit).offset(offset)
+                return [item.id for item in session.execute(stmt).scalars()]
+
+            assert ids(ProductWithIndex.price, limit=2) == [2, 3]
+            assert ids(ProductWithIndex.price.desc(), limit=2) == [4, 1]
+            assert ids(ProductWithIndex.price, limit=2, offset=1) == [3, 1]
+            assert ids(ProductWithIndex.category, ProductWithIndex.price, limit=3) == [2, 4, 3]
+            assert ids(ProductWithIndex.category.desc(), ProductWithIndex.price.desc(), limit=3) == [1, 3, 4]
+            assert ids(ProductWithIndex.category, ProductWithIndex.price.desc(), limit=3) == [4, 2, 1]
+            assert ids(ProductWithIndex.price.desc(), ProductWithIndex.category, limit=2, offset=1) == [1, 2]
+            assert ids(ProductWithIndex.price, limit=10) == [2, 3, 1, 4]
+            assert ids(ProductWithIndex.category, ProductWithIndex.price) == [2, 4, 3, 1]
+            assert ids(ProductWithIndex.category.desc(), ProductWithIndex.price.desc()) == [1, 3, 4, 2]
+            assert ids(ProductWithIndex.category, ProductWithIndex.price.desc()) == [4, 2, 1, 3]
+
+    def test_query_filter(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                Item(id=1, name="foo"),
+                Item(id=2, name="bar"),
+                Item(id=3, name="foobar"),
+            ])
+            session.commit()
+
+            query = MemoryQuery(select(Item).where(Item.id > 1), session)
+            query = query.filter(or_(Item.name == "foo", Item.name.like("foo%")).self_group())
+            assert [item.id for item in query.all()] == [3]
+
+    def test_or_table_order(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="A", vendor_id=10),
+                ProductWithIndex(id=2, name="bar", category="B", vendor_id=20),
+                ProductWithIndex(id=3, name="foobar", category="B", vendor_id=10),
+                ProductWithIndex(id=4, name="baz", category="C", vendor_id=10),
+            ])
+            session.commit()
+
+            stmt = select(ProductWithIndex).where(
+                or_(ProductWithIndex.category == "B", ProductWithIndex.vendor_id == 10)
+            )
+            results = session.execute(stmt).scalars().all()
+            assert [item.id for item in results] == [1, 2, 3, 4]
+
+    def test_where_normalization(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                Item(id=1, name="foo"),
+                Item(id=2, name="bar"),
+                Item(id=3, name="foobar"),
+            ])
+            session.commit()
+
+            a, b, c = Item.id > 1, Item.name != "bar", Item.id < 10
+            stmt = select(Item).where(and_(a, and_(b, or_(c, or_(Item.id == 1, Item.id == 2)))))
+            query = MemoryQuery(stmt, session)
+            criteria = query._where_criteria
+            assert len(criteria) == 3
+            assert criteria[0] is a and criteria[1] is b
+            assert len(criteria[2].clauses) == 3
+
+            results = session.execute(stmt).scalars().all()
+            assert [item.id for item in results] == [3]
+
+            condition = Item.id == 1
+            stmt = select(Item).where(condition, true())
+            criteria = MemoryQuery(stmt, session)._where_criteria
+            assert len(criteria) == 1 and criteria[0] is condition
+            assert [item.id for item in session.execute(stmt).scalars()] == [1]
+
+            stmt = select(Item).where(Item.id > 1, false())
+            assert session.execute(stmt).scalars().all() == []
+
+    def test_statement_reexecuted(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="A", price=10, vendor_id=10),
+                ProductWithIndex(id=2, name="bar", category="B", price=20, vendor_id=10),
+            ])
+            session.commit()
+
+            stmt = select(ProductWithIndex).where(ProductWithIndex.price > 5).order_by(ProductWithIndex.price.desc()).limit(2)
+            assert [item.id for item in session.scalars(stmt)] == [2, 1]
+
+            session.add(ProductWithIndex(id=3, name="baz", category="A", price=30, vendor_id=10))
+            session.commit()
+            assert [item.id for item in session.scalars(stmt)] == [3, 2]
+
+            query = MemoryQuery(stmt, session).filter(ProductWithIndex.category == "A")
+            assert [item.id for item in query.all()] == [3, 1]
+
+    def test_condition_cost(self, SessionFactory):
+        with SessionFactory() as session:
+            query = MemoryQuery(select(Product), session)
+
+            conditions = [
+                func.json_extract(Product.data, "$.ref") == 1,
+                Product.name.like("foo%"),
+                Product.category.in_(["A", "B"]),
+                or_(Product.name == "foo", Product.category == "A"),
+                Product.name > "foo",
+                Product.active.is_(True),
+            ]
+            costs = [query._get_condition_cost(cond) for cond in conditions]
+            assert costs == sorted(costs, reverse=True)
@@ -1,6 +1,9 @@
 import pytest
 
-from sqlalchemy import func, select, case
+from sqlalchemy import func, select, case, distinct, literal_column, null
+from datetime import datetime
+
+from sqlalchemy_memory.base.query import MemoryQuery
 
 from models import ProductWithIndex, Vendor
 
@@ -80,3 +83,96 @@ class TestAggregation:
 
             assert results[1] == (1, 3)
             assert results[1].minimum == 3
+
+            results = session.execute(
+                select(ProductWithIndex.vendor_id, ProductWithIndex.category, func.count(ProductWithIndex.id))
+                .group_by(ProductWithIndex.vendor_id, ProductWithIndex.category)
+            )
+            assert list(results) == [(10, "A", 1), (10, "B", 1), (20, "B", 1)]
+
+    def test_count(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="A", vendor_id=10),
+                ProductWithIndex(id=2, name="bar", category="B", vendor_id=10),
+                ProductWithIndex(id=3, name="foobar", category="B", vendor_id=20),
+            ])
+            session.commit()
+
+            stmt = select(func.count()).select_from(ProductWithIndex)
+            assert session.execute(stmt).scalar() == 3
+
+            stmt = select(func.count(ProductWithIndex.id).label("n")).where(ProductWithIndex.category == "B")
+            assert session.execute(stmt).mappings().one() == {"n": 2}
+
+            stmt = select(func.count()).select_from(ProductWithIndex).where(ProductWithIndex.name == "baz")
+            assert session.execute(stmt).scalar() == 0
+
+    def test_count_arguments(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="A", vendor_id=10),
+                ProductWithIndex(id=2, name="bar", category="B", vendor_id=10),
+                ProductWithIndex(id=3, name="foobar", category="B", vendor_id=20),
+            ])
+            session.commit()
+
+            def count(*args):
+                stmt = select(func.count(*args)).select_from(ProductWithIndex)
+                return session.execute(stmt).scalar()
+
+            # Counts of every row
+            assert count(1) == 3
+            assert count(literal_column("*")) == 3
+
+            # Other arguments aren't taken as a row count
+            query = MemoryQuery(select(func.count(distinct(ProductWithIndex.vendor_id))), session)
+            assert not query.is_count_select
+            query = MemoryQuery(select(func.count(ProductWithIndex.created_at)), session)
+            assert not query.is_count_select
+            query = MemoryQuery(select(func.count(null())).select_from(ProductWithIndex), session)
+            assert not query.is_count_select
+
+    def test_count_values(self, SessionFactory):
+        with SessionFactory() as session:
+            vendor1 = Vendor(id=10, name="First vendor")
+            vendor2 = Vendor(id=20, name="Second vendor")
+            session.add_all([vendor1, vendor2])
+
+            session.add_all([
+                ProductWithIndex(id=1, name="foo", category="A", vendor_id=10, vendor=vendor1, created_at=datetime(2025, 1, 1)),
+                ProductWithIndex(id=2, name="bar", category="B", vendor_id=10, vendor=vendor1),
+                ProductWithIndex(id=3, name="foobar", category="B", vendor_id=20, vendor=vendor2, created_at=datetime(2025, 1, 1)),
+            ])
+            session.commit()
+
+            def count(arg):
+                stmt = select(func.count(arg)).select_from(ProductWithIndex)
+                return session.execute(stmt).scalar()
+
+            # NULL values are not counted
+            assert count(ProductWithIndex.created_at) == 2
+            assert count(ProductWithIndex.vendor_id) == 3
+
+            # Distinct non-NULL values
+            assert count(distinct(ProductWithIndex.vendor_id)) == 2
+            assert count(ProductWithIndex.vendor_id.distinct()) == 2
+            assert count(distinct(ProductWithIndex.created_at)) == 1
+
+            # Column of a related model
+            assert count(distinct(Vendor.name)) == 2
+
+            # Per group
+            stmt = (
+                select(
+                    ProductWithIndex.category,
+                    func.count(distinct(ProductWithIndex.vendor_id)),
+                    func.count(ProductWithIndex.created_at),
+                )
+                .group_by(ProductWithIndex.category)
+            )
+            assert list(session.execute(stmt)) == [("A", 1, 1), ("B", 2, 1)]
+
+            # Expressions aren't supported
+            with pytest.raises(NotImplementedError):
+                count(ProductWithIndex.price * 2)
@@ -36,6 +36,22 @@ class TestBasic:
             items = session.scalars(select(Item)).all()
             assert len(items) == 0
 
+    def test_partial_fetch(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([Item(id=i, name=f"item{i}") for i in range(1, 8)])
+            session.commit()
+
+            result = session.execute(select(Item))
+            assert result.fetchone()[0].id == 1
+            assert [row[0].id for row in result.fetchmany(2)] == [2, 3]
+            assert [item.id for item in result.scalars()] == [4, 5, 6, 7]
+
+            result = session.execute(select(Item)).yield_per(3)
+            assert [len(p) for p in result.partitions()] == [3, 3, 1]
+
+            result = session.execute(select(Item.name))
+            assert result.first() == ("item1",)
+
     def test_rollback(self, SessionFactory):
         with SessionFactory() as session:
             session.add(Item(id=1, name="foo"))
@@ -1,4 +1,6 @@
 from sqlalchemy import select, insert, update, delete, desc
+from sqlalchemy.exc import InvalidRequestError
+import pytest
 
 from models import Item
 
@@ -31,6 +33,28 @@ class TestCRUD:
                 assert items[2].id == 3
                 assert items[2].name == "fba"
 
+    def test_select_empty_table(self, SessionFactory):
+        with SessionFactory() as session:
+            assert session.scalars(select(Item)).all() == []
+            assert session.scalars(select(Item).where(Item.name == "foo")).first() is None
+            assert session.execute(select(Item.id, Item.name).order_by(Item.id).limit(1)).all() == []
+
+    def test_select_by_primary_key(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                Item(id=1, name="foo"),
+                Item(id=2, name="bar"),
+            ])
+            session.commit()
+
+            assert [item.name for item in session.scalars(select(Item).where(Item.id == 2))] == ["bar"]
+            assert session.scalars(select(Item).where(Item.id == 3)).all() == []
+            assert session.execute(select(Item.name).where(Item.id == 1)).all() == [("foo",)]
+
+            session.execute(delete(Item).where(Item.id == 1))
+            session.commit()
+            assert [item.id for item in session.scalars(select(Item))] == [2]
+
     def test_insert_returning(self, sqlite_SessionFactory, SessionFactory):
         with sqlite_SessionFactory() as session:
             stmt = insert(Item).values(name="foo").returning(Item.id, Item.name)
@@ -51,6 +75,50 @@ class TestCRUD:
             item = session.get(Item, returned.id)
             assert item is None
 
+    def test_insert_returning_columns(self, SessionFactory):
+        with SessionFactory() as session:
+            stmt = insert(Item).values(id=5, name="foo").returning(Item.id, Item.name)
+            assert session.execute(stmt).all() == [(5, "foo")]
+
+            stmt = insert(Item).returning(Item.name)
+            assert session.execute(stmt, [dict(name="bar"), dict(name="baz")]).all() == [("bar",), ("baz",)]
+
+    def test_add_twice(self, SessionFactory):
+        with SessionFactory() as session:
+            item = Item(id=1, name="foo")
+            session.add(item)
+            session.add(item)
+            session.add_all([item, Item(id=2, name="bar")])
+            session.commit()
+
+            assert len(session.scalars(select(Item)).all()) == 2
+
+    def test_flush_twice(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add(Item(id=1, name="foo"))
+            session.flush()
+            session.add(Item(id=2, name="bar"))
+            session.flush()
+            session.add(Item(id=3, name="baz"))
+            session.commit()
+
+            assert [item.id for item in session.scalars(select(Item))] == [1, 2, 3]
+
+    def test_rollback_changes(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add(Item(id=1, name="foo"))
+            session.commit()
+
+            item = session.get(Item, 1)
+            item.name = "bar"
+            item.name = "baz"
+            session.rollback()
+            assert item.name == "foo"
+
+            # Still tracked after a rollback
+            item.name = "bar"
+            session.commit()
+            assert session.get(Item, 1).name == "bar"
 
     def test_update(self, SessionFactory):
         with SessionFactory() as session:
@@ -99,6 +167,38 @@ class TestCRUD:
 
                 assert [item.name for item in items] == ["hello", "bar-modified", "hello"]
 
+
+    def test_bulk_update(self, SessionFactory):
+        with SessionFactory() as session:
+            session.add_all([
+                Item(id=1, name="foo"),
+                Item(id=2, name="bar"),
+                Item(id=3, name="three"),
+            ])
+            session.commit()
+
+            result = session.execute(update(Item), [
+                {"id": 1, "name": "foo-modified"},
+                {"id": 3, "name": "three-modified"},
+                {"id": 4, "name": "missing"},
+            ])
+            assert result.rowcount == 2
+            session.commit()
+
+            items = session.execute(select(Item).order_by(Item.id)).scalars().all()
+            assert [item.name for item in items] == ["foo-modified", "bar", "three-modified"]
+
+            # Parameters without primary key: nothing is updated
+            with pytest.raises(InvalidRequestError, match="items.id"):
+                session.execute(update(Item), [
+                    {"id": 2, "name": "bar-modified"},
+                    {"name": "no-id"},
+                ])
+            session.commit()
+
+            items = session.execute(select(Item).order_by(Item.id)).scalars().all()
+            assert [item.name for item in items] == ["foo-modified", "bar", "three-modified"]
+
     def test_get(self, SessionFactory):
         with SessionFactory() as session:
             with session.begin():
@@ -194,6 +294,11 @@ class TestCRUD:
                 assert item is not None
                 assert item.name == "foo-modified"  # change now persisted
 
+            with session.begin():
+                # Nothing changed: no pending changes
+                session.merge(Item(id=1, name="foo-modified"))
+                assert not session.dirty
+
     def test_delete(self, SessionFactory):
         with SessionFactory() as session:
             with session.begin():
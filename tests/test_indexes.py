@@ -29,6 +29,32 @@ class TestIndexes:
         results = index.query("table1", "activeIndex", False)
         assert {r.id for r in results} == {2}
 
+    def test_hash_index_query_many(self):
+        index = HashIndex()
+
+        index.add("table1", "categoryIndex", "A", MagicMock(id=1))
+        index.add("table1", "categoryIndex", "B", MagicMock(id=2))
+        index.add("table1", "categoryIndex", "C", MagicMock(id=3))
+
+        results = index.query_many("table1", "categoryIndex", ["A", "C", "A", "Z"])
+        assert [r.id for r in results] == [1, 3]
+
+    def test_hash_index_snapshot(self):
+        index = HashIndex()
+        mock1 = MagicMock(id=1)
+
+        index.add("table1", "categoryIndex", "A", mock1)
+        index.add("table1", "categoryIndex", "A", MagicMock(id=2))
+
+        snapshot = index.snapshot("table1", "categoryIndex", "A")
+        assert [r.id for r in snapshot] == [1, 2]
+        assert index.snapshot("table1", "categoryIndex", "A") is snapshot
+
+        index.remove("table1", "categoryIndex", "A", mock1)
+        assert [r.id for r in snapshot] == [1, 2]
+        assert [r.id for r in index.snapshot("table1", "categoryIndex", "A")] == [2]
+        assert index.snapshot("table1", "categoryIndex", "Z") == ()
+
     def test_hash_compound_index(self):
         index = HashIndex()
         mock3 = MagicMock(id=3)
@@ -46,6 +72,25 @@ class TestIndexes:
         results = index.query("table1", "active_category", (False, "A"))
         assert {r.id for r in results} == set()
 
+    def test_range_index_updates(self):
+        index = RangeIndex()
+        objs = [MagicMock(id=i, price=price) for i, price in enumerate([30, None, 10, 20, 10])]
+
+        for obj in objs:
+            index.add("products", "price_index", obj.price, obj)
+
+        # NULL values are not indexed
+        assert [r.id for r in index.query("products", "price_index")] == [2, 4, 3, 0]
+
+        index.remove("products", "price_index", 10, objs[2])
+        index.remove("products", "price_index", 30, objs[0])
+        index.add("products", "price_index", 15, objs[0])
+        index.remove("products", "price_index", 10, objs[4])
+        index.add("products", "price_index", 10, objs[4])
+
+        assert [r.id for r in index.query("products", "price_index", gt=5)] == [4, 0, 3]
+        assert index.key_fraction("products", "price_index", gte=15) == pytest.approx(2 / 3)
+
     @pytest.mark.parametrize("query_kwargs,expected_ids", [
         ({"gt": 10}, {2, 3}),
         ({"gte": 20}, {2, 3}),
@@ -107,6 +152,78 @@ class TestIndexes:
             assert len(result) == 2
             assert set(r.id for r in result) == {2, 3}
 
+        result = list(mgr.query(objs, "products", "price", operators.not_between_op, (15, 25), collection_is_full_table=True))
+        assert len(result) == 2
+        assert set(r.id for r in result) == {1, 2}
+
+        # Narrowed collections are left to the condition itself
+        assert mgr.query(objs, "products", "price", operators.not_between_op, (15, 25)) is None
+
+        for full in [True, False]:
+            assert list(mgr.query(objs, "products", "price", operators.eq, 99, collection_is_full_table=full)) == []
+            assert list(mgr.query(objs, "products", "id", operators.in_op, [7, 8], collection_is_full_table=full)) == []
+
+    def test_index_manager_insert_many(self):
+        mgr = IndexManager()
+        mgr.table_indexes = {
+            "products": {
+                "id": ["id"],
+                "price_index": ["price"]
+            }
+        }
+
+        objs = [
+            MagicMock(id=1, price=10, __tablename__="products"),
+            MagicMock(id=2, price=30, __tablename__="products"),
+            MagicMock(id=3, price=10, __tablename__="products"),
+        ]
+
+        mgr.on_insert(objs[0])
+        mgr.on_insert_many(objs[1:])
+        mgr.on_insert_many([])
+
+        result = list(mgr.query(objs, "products", "price", operators.eq, 10, collection_is_full_table=True))
+        assert {r.id for r in result} == {1, 3}
+
+        result = list(mgr.query(objs, "products", "price", operators.gt, 10, collection_is_full_table=True))
+        assert {r.id for r in result} == {2}
+
+        result = list(mgr.query(objs, "products", "id", operators.in_op, [2, 3], collection_is_full_table=True))
+        assert {r.id for r in result} == {2, 3}
+
+    def test_index_manager_delete_many(self):
+        mgr = IndexManager()
+        mgr.table_indexes = {
+            "products": {
+                "id": ["id"],
+                "price_index": ["price"]
+            }
+        }
+
+        objs = [
+            MagicMock(id=i, price=10 * (i % 3), __tablename__="products")
+            for i in range(1, 41)
+        ]
+        mgr.on_insert_many(objs)
+
+        # Enough emptied values for the sorted keys to be filtered at once
+        deleted = objs[:30]
+        mgr.on_delete_many(deleted)
+        mgr.on_delete_many([])
+        remaining = objs[30:]
+
+        result = list(mgr.query(objs, "products", "price", operators.eq, 10, collection_is_full_table=True))
+        assert {r.id for r in result} == {o.id for o in remaining if o.price == 10}
+
+        result = list(mgr.query(objs, "products", "id", operators.gt, 0, collection_is_full_table=True))
+        assert [r.id for r in result] == [o.id for o in remaining]
+
+        # Then a few, deleted from the sorted keys one by one
+        mgr.on_delete_many(remaining[:2])
+
+        result = list(mgr.query(objs, "products", "id", operators.le, 35, collection_is_full_table=True))
+        assert [r.id for r in result] == [33, 34, 35]
+
 
 
     @pytest.mark.parametrize("query_kwargs,expected_ids", [
@@ -146,6 +263,22 @@ class TestIndexes:
 
         assert {r.id for r in results} == expected_ids
 
+    @pytest.mark.parametrize("query_kwargs,expected", [
+        ({"gt": 10}, 0.75),
+        ({"gte": 10}, 1),
+        ({"lt": 20}, 0.25),
+        ({"gte": 15, "lte": 30}, 0.5),
+        ({"gt": 40}, 0),
+        ({"gt": 30, "lt": 10}, 0),
+    ])
+    def test_range_key_fraction(self, query_kwargs, expected):
+        index = RangeIndex()
+
+        for idx, price in enumerate([10, 20, 30, 40, 20]):
+            index.add("products", "price_index", price, MagicMock(id=idx))
+
+        assert index.key_fraction("products", "price_index", **query_kwargs) == pytest.approx(expected)
+
     @pytest.mark.parametrize("operator,value,expected", [
         (operators.eq, "A", 3),
         (operators.eq, "Z", 0),  # "Z" not present
@@ -179,6 +312,37 @@ class TestIndexes:
         result = index_manager.get_selectivity(tablename, colname, operator, value, total_count)
         assert result == pytest.approx(expected)
 
+    def test_range_selectivity(self):
+        mgr = IndexManager()
+        mgr.table_indexes = {
+            "products": {
+                "price_index": ["price"]
+            }
+        }
+        mgr.on_insert_many([
+            MagicMock(id=i, price=i, __tablename__="products")
+            for i in range(100)
+        ])
+
+        def selectivity(operator, value):
+            return mgr.get_selectivity("products", "price", operator, value, total_count=100)
+
+        assert selectivity(operators.between_op, (10, 19)) == pytest.approx(10)
+        assert selectivity(operators.not_between_op, (10, 19)) == pytest.approx(90)
+        assert selectivity(operators.not_between_op, (-10, 200)) == 0
+
+    def test_register_table(self):
+        tablename = ProductWithIndex.__tablename__
+        index_manager = IndexManager()
+
+        # Unknown table: the miss isn't cached
+        assert index_manager._column_to_index(tablename, "category") is None
+
+        index_manager.register_table(ProductWithIndex.__table__)
+        assert index_manager._column_to_index(tablename, "category") == "ix_products_with_index_category"
+        assert index_manager._column_to_index(tablename, "id") == "id"
+        assert index_manager._column_to_index(tablename, "name") is None
+
     def test_synchronized_indexes(self, SessionFactory):
         tablename = ProductWithIndex.__tablename__
 